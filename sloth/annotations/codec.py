@@ -0,0 +1,131 @@
+"""
+Encoding of polygon coordinates in annotations.
+
+Polygons are stored either as text, i.e. ``';'``-joined decimal strings in
+``xn`` and ``yn``, or in the compact encoding in ``pn``: the coordinates
+packed as little-endian binary and URL-safe base64 encoded.  The compact encoding is
+``'i16:'`` followed by the first point as two float32 and the deltas between
+consecutive points in tenths of a pixel as int16, or ``'f32:'`` followed by
+all points as float32 if a delta does not fit into an int16.
+
+Both are always understood when reading.  New polygons are written in the
+encoding set with :func:`setEncoding`, which the network layer does once
+the server announced the encodings it supports.
+"""
+import base64
+import numpy as np
+
+TEXT = 'text'
+COMPACT = 'compact'
+ENCODINGS = (TEXT, COMPACT)
+
+# resolution of the int16 deltas, in fractions of a pixel
+SCALE = 10.0
+
+_encoding = TEXT
+
+
+def setEncoding(encoding):
+    global _encoding
+    if encoding not in ENCODINGS:
+        raise ValueError("Unknown polygon encoding %s" % encoding)
+    _encoding = encoding
+
+
+def encoding():
+    return _encoding
+
+
+def encodePoints(xs, ys):
+    """
+    Returns the compact encoding of the points with the coordinates ``xs``
+    and ``ys``.
+    """
+    points = np.empty((len(xs), 2))
+    points[:, 0] = xs
+    points[:, 1] = ys
+    if len(points):
+        deltas = np.diff(np.round((points - points[0]) * SCALE), axis=0)
+        if len(deltas) == 0 or np.abs(deltas).max() <= 32767:
+            data = points[0].astype('<f4').tobytes() + deltas.astype('<i2').tobytes()
+            return 'i16:' + base64.urlsafe_b64encode(data).decode('ascii')
+    return 'f32:' + base64.urlsafe_b64encode(points.astype('<f4').tobytes()).decode('ascii')
+
+
+def decodePoints(text):
+    """
+    Returns the coordinates ``(xs, ys)`` of compactly encoded points.
+    """
+    kind, _, data = text.partition(':')
+    data = base64.urlsafe_b64decode(data)
+    if kind == 'f32':
+        points = np.frombuffer(data, dtype='<f4').reshape(-1, 2).astype(float)
+    elif kind == 'i16':
+        if not data:
+            return np.empty(0), np.empty(0)
+        first = np.frombuffer(data[:8], dtype='<f4').astype(float)
+        deltas = np.frombuffer(data[8:], dtype='<i2').reshape(-1, 2)
+        points = np.empty((len(deltas) + 1, 2))
+        points[0] = first
+        points[1:] = first + np.cumsum(deltas, axis=0) / SCALE
+    else:
+        raise ValueError("Unknown polygon encoding %s" % kind)
+    return points[:, 0], points[:, 1]
+
+
+def _parseText(text):
+    if not text:
+        return np.empty(0)
+    return np.array(text.split(';'), dtype=float)
+
+
+def polygonPoints(ann, prefix=''):
+    """
+    Returns the polygon coordinates ``(xs, ys)`` of annotation ``ann`` in
+    either encoding.  Raises KeyError if it has none.
+    """
+    if prefix + 'pn' in ann:
+        return decodePoints(ann[prefix + 'pn'])
+    return _parseText(ann[prefix + 'xn']), _parseText(ann[prefix + 'yn'])
+
+
+def polygonData(xs, ys, prefix='', encoding=None):
+    """
+    Returns the keys to set in an annotation for the polygon ``xs``, ``ys``
+    in ``encoding``, the current one by default.
+    """
+    if (encoding or _encoding) == COMPACT:
+        return {prefix + 'pn': encodePoints(xs, ys)}
+    return {prefix + 'xn': ';'.join([str(float(x)) for x in xs]),
+            prefix + 'yn': ';'.join([str(float(y)) for y in ys])}
+
+
+def setPolygon(ann, xs, ys, prefix=''):
+    """
+    Stores the polygon ``xs``, ``ys`` in annotation ``ann`` in the current
+    encoding and removes the keys of the other one.
+    """
+    data = polygonData(xs, ys, prefix)
+    ann.update(data)
+    for key in ('pn', 'xn', 'yn'):
+        if prefix + key not in data and prefix + key in ann:
+            del ann[prefix + key]
+
+
+def encodeAnnotation(ann, encoding=None):
+    """
+    Returns annotation ``ann`` with its polygon in ``encoding``, the
+    current one by default.  ``ann`` itself is returned if it has no
+    polygon or is encoded that way already, otherwise a converted copy.
+    """
+    encoding = encoding or _encoding
+    if encoding == COMPACT:
+        convert = 'xn' in ann and 'pn' not in ann
+    else:
+        convert = 'pn' in ann
+    if not convert:
+        return ann
+    xs, ys = polygonPoints(ann)
+    ann = dict((key, item) for key, item in ann.items() if key not in ('pn', 'xn', 'yn'))
+    ann.update(polygonData(xs, ys, encoding=encoding))
+    return ann
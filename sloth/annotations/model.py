@@ -3,36 +3,220 @@ from PyQt5.QtWidgets import *
 from PyQt5.QtGui import *
 from PyQt5.QtCore import *
 
-from collections import MutableMapping
+from collections.abc import MutableMapping
+import bisect
+import logging
 import os
 import copy
 
+LOG = logging.getLogger(__name__)
+
 ItemRole, DataRole, ImageRole = [Qt.UserRole + ur + 1 for ur in range(3)]
 
+
+class _ChildBlock:
+    __slots__ = ('entries', 'start', 'pos')
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.start = 0
+        self.pos = 0
+
+
+class ChildList:
+    """
+    The children of a :class:`ModelItem`, stored in blocks of up to
+    ``2 * blockSize`` entries.
+
+    Each child item knows its block and its position in it, and the blocks
+    know their first row, recomputed lazily after an insert or delete.
+    Row lookup, insert and delete thus touch one block plus the list of
+    block offsets, O(sqrt(n)) instead of renumbering all following
+    children.  Entries which are not model items (annotations that are not
+    loaded yet) are stored as they are.
+    """
+
+    blockSize = 128
+
+    def __init__(self, entries=()):
+        self._blocks = []
+        self._starts = []
+        self._stale = 0
+        self._len = 0
+        if entries:
+            self.extend(entries)
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for block in self._blocks:
+            yield from block.entries
+
+    def __getitem__(self, row):
+        block, i = self._locate(row)
+        return block.entries[i]
+
+    def __setitem__(self, row, entry):
+        block, i = self._locate(row)
+        block.entries[i] = entry
+        self._place(block, i, i + 1)
+
+    def __delitem__(self, row):
+        block, i = self._locate(row)
+        del block.entries[i]
+        self._len -= 1
+        if block.entries:
+            self._place(block, i, len(block.entries))
+            self._invalidate(block.pos + 1)
+        else:
+            del self._blocks[block.pos]
+            self._invalidate(block.pos)
+
+    def append(self, entry):
+        if not self._blocks or len(self._blocks[-1].entries) >= 2 * self.blockSize:
+            block = _ChildBlock([])
+            block.pos = len(self._blocks)
+            block.start = self._len
+            self._blocks.append(block)
+            if self._stale == block.pos:
+                self._starts.append(block.start)
+                self._stale += 1
+        block = self._blocks[-1]
+        block.entries.append(entry)
+        self._len += 1
+        self._place(block, len(block.entries) - 1, len(block.entries))
+
+    def extend(self, entries):
+        entries = list(entries)
+        if self._blocks:
+            # fill up the last block first
+            block = self._blocks[-1]
+            n = max(0, 2 * self.blockSize - len(block.entries))
+            first = len(block.entries)
+            block.entries.extend(entries[:n])
+            self._len += len(block.entries) - first
+            self._place(block, first, len(block.entries))
+            entries = entries[n:]
+        for i in range(0, len(entries), self.blockSize):
+            block = _ChildBlock(entries[i:i + self.blockSize])
+            block.pos = len(self._blocks)
+            block.start = self._len
+            self._blocks.append(block)
+            if self._stale == block.pos:
+                self._starts.append(block.start)
+                self._stale += 1
+            self._len += len(block.entries)
+            self._place(block, 0, len(block.entries))
+
+    def insert(self, row, entry):
+        if row >= self._len:
+            self.append(entry)
+            return
+        block, i = self._locate(row)
+        block.entries.insert(i, entry)
+        self._len += 1
+        if len(block.entries) > 2 * self.blockSize:
+            # split the block in halves
+            tail = _ChildBlock(block.entries[self.blockSize:])
+            tail.pos = block.pos + 1
+            del block.entries[self.blockSize:]
+            self._blocks.insert(tail.pos, tail)
+            self._place(tail, 0, len(tail.entries))
+        self._place(block, i, len(block.entries))
+        self._invalidate(block.pos + 1)
+
+    def rowOf(self, item):
+        """
+        Returns the row of ``item``, which must be a model item in this list.
+        """
+        block = item._block
+        if block.pos >= self._stale:
+            self._update()
+        return block.start + item._blockRow
+
+    def _place(self, block, first, last):
+        entries = block.entries
+        for i in range(first, last):
+            entry = entries[i]
+            if isinstance(entry, ModelItem):
+                entry._block = block
+                entry._blockRow = i
+
+    def _invalidate(self, pos):
+        if pos < self._stale:
+            self._stale = pos
+            del self._starts[pos:]
+
+    def _update(self):
+        start = self._starts[-1] + len(self._blocks[self._stale - 1].entries) if self._stale else 0
+        for pos in range(self._stale, len(self._blocks)):
+            block = self._blocks[pos]
+            block.pos = pos
+            block.start = start
+            self._starts.append(start)
+            start += len(block.entries)
+        self._stale = len(self._blocks)
+
+    def _locate(self, row):
+        if row < 0:
+            row += self._len
+        if row < 0 or row >= self._len:
+            raise IndexError("child index out of range")
+        if self._stale < len(self._blocks):
+            self._update()
+        block = self._blocks[bisect.bisect_right(self._starts, row) - 1]
+        return block, row - block.start
+
+
 class ModelItem:
     def __init__(self):
+        # children can be loaded lazily: their slots hold the raw data until
+        # _createChild() builds the item, _unloaded counts those slots
         self._loaded = True
+        self._unloaded = 0
         self._model = None
         self._parent = None
-        self._row = -1
+        # position in the parent's ChildList
+        self._block = None
+        self._blockRow = -1
         if not hasattr(self, "_children"):
-            self._children = []
+            self._children = ChildList()
+
+    def _setUnloaded(self, count):
+        self._unloaded = count
+        self._loaded = count == 0
+
+    def _createChild(self, data):
+        raise NotImplementedError
 
     def _load(self, index):
-        pass
+        self.replaceChild(index, self._createChild(self._children[index]))
+        self._setUnloaded(self._unloaded - 1)
+
+    def _loadAll(self):
+        # builds all missing children in a single pass
+        children = []
+        for child in self._children:
+            if not isinstance(child, ModelItem):
+                child = self._createChild(child)
+                child._parent = self
+                if self._model is not None:
+                    child._attachToModel(self._model)
+            children.append(child)
+        self._children = ChildList(children)
+        self._setUnloaded(0)
 
     def _ensureLoaded(self, index):
         if not self._loaded:
             if not isinstance(self._children[index], ModelItem):
-                print(self._children[index])
                 self._load(index)
                 return True
         return False
 
     def _ensureAllLoaded(self):
         if not self._loaded:
-            for i in range(len(self._children)):
-                self._ensureLoaded(i)
+            self._loadAll()
             return True
         return False
 
@@ -43,7 +227,9 @@ class ModelItem:
         return self.childAt(row).hasChildren()
 
     def row(self):
-        return self._row
+        if self._parent is None:
+            return -1
+        return self._parent._children.rowOf(self)
 
     def rowCount(self):
         return len(self._children)
@@ -90,13 +276,14 @@ class ModelItem:
         return self._children[pos]
 
     def getPreviousSibling(self, step=1):
-        if self._row - step < 0:
-            return self.getSibling(self._row)
+        row = self.row()
+        if row - step < 0:
+            return self.getSibling(row)
         else:
-            return self.getSibling(self._row-step)
+            return self.getSibling(row-step)
 
     def getNextSibling(self, step=1):
-        return self.getSibling(self._row+step)
+        return self.getSibling(self.row()+step)
 
     def getSibling(self, row):
         if self._parent is not None:
@@ -117,7 +304,7 @@ class ModelItem:
             return QModelIndex()
         if column >=self._model.columnCount():
             return QModelIndex()
-        return self._model.createIndex(self._row, column, self._parent)
+        return self._model.createIndex(self.row(), column, self._parent)
 
     def addChildSorted(self, item, signalModel=True):
         self.insertChild(-1, item, signalModel=signalModel)
@@ -127,7 +314,6 @@ class ModelItem:
 
     def replaceChild(self, pos, item):
         item._parent = self
-        item._row = pos
         self._children[pos] = item
         if self._model is not None:
             self._children[pos]._attachToModel(self._model)
@@ -141,13 +327,8 @@ class ModelItem:
             self._model.beginInsertRows(self.index(), next_row, next_row)
 
         item._parent = self
-        item._row = next_row
         self._children.insert(next_row, item)
 
-        if pos >= 0:
-            for i,c in enumerate(self._children):
-                c._row = i
-
         if self._model is not None:
             item._attachToModel(self._model)
             if signalModel:
@@ -158,10 +339,9 @@ class ModelItem:
         if self._model is not None and signalModel:
             self._model.beginInsertRows(self.index(), next_row, next_row+len(items)-1)
 
-        for i, item in enumerate(items):
+        for item in items:
             item._parent = self
-            item._row = next_row+i
-            self._children.append(item)
+        self._children.extend(items)
 
         if self._model is not None:
             for item in items:
@@ -177,7 +357,9 @@ class ModelItem:
 
     def deleteChild(self, arg):
         if isinstance(arg, ModelItem):
-            return self.deleteChild(self._children.index(arg))
+            if arg._parent is not self or self._children[arg.row()] is not arg:
+                raise ValueError("item is not a child of this item")
+            return self.deleteChild(arg.row())
         else:
             if arg<0 or arg>=len(self._children):
                 raise IndexError("child index out of range")
@@ -188,18 +370,15 @@ class ModelItem:
 
             del self._children[arg]
 
-            for i,c in enumerate(self._children):
-                c._row = i
-
             if self._model is not None:
                 self._model.endRemoveRows()
 
     def deleteAllChildren(self):
-        self._ensureAllLoaded()
         if self._model is not None:
             self._model.beginRemoveRows(self.index(), 0, len(self._children)-1)
 
-        self._children = []
+        self._children = ChildList()
+        self._setUnloaded(0)
 
         if self._model is not None:
             self._model.endRemoveRows()
@@ -214,20 +393,12 @@ class RootModelItem(ModelItem):
     def __init__(self, model, files):
         ModelItem.__init__(self)
         self._model = model
-        self._toload = []
-        for f in files:
-            self._toload.append(f)
-            self._children.append(f)
-        self._loaded = False
+        self._children.extend(files)
+        self._setUnloaded(len(self._children))
 
-    def _load(self, index):
-        self._toload.remove(self._children[index])
-        print(self._children)
-        print(self._children[index])
-        fi = ImageFileModelItem(self._children[index])
-        self.replaceChild(index, fi)
-        if len(self._toload) == 0:
-            self._loaded = True
+    def _createChild(self, fileinfo):
+        LOG.debug("Loading image %s", fileinfo.get('picId'))
+        return ImageFileModelItem(fileinfo)
 
     def childHasChildren(self, pos):
         if isinstance(self._children[pos], ModelItem):
@@ -255,6 +426,7 @@ class RootModelItem(ModelItem):
     def appendFileItems(self, fileinfos):
         items = [ImageFileModelItem(fi) for fi in fileinfos]
         self.appendChildren(items)
+        return items
 
     def numFiles(self):
         return len(self.children())
@@ -293,12 +465,17 @@ class KeyValueModelItem(ModelItem, MutableMapping):
 
     def addChildSorted(self, item, signalModel=True):
         if isinstance(item, KeyValueRowModelItem):
-            next_row = 0
-            for child in self._children:
-                if not isinstance(child, KeyValueRowModelItem) or child.key() > item.key():
-                    break
-                next_row += 1
-            self.insertChild(next_row, item, signalModel)
+            # the key rows come first, ordered by key: insert behind the
+            # last one with a key not greater than the item's
+            lo, hi = 0, len(self._children)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                child = self._children[mid]
+                if isinstance(child, KeyValueRowModelItem) and child.key() <= item.key():
+                    lo = mid + 1
+                else:
+                    hi = mid
+            self.insertChild(lo, item, signalModel)
         else:
             self.appendChild(item, signalModel)
 
@@ -325,12 +502,16 @@ class KeyValueModelItem(ModelItem, MutableMapping):
 
     def __delitem__(self, key):
         del self._dict[key]
-        if key in self._items:
-            self.deleteChild(self._items[key])
+        item = self._items.pop(key, None)
+        # rows of keys added after construction are not in the tree
+        if item is not None and item._parent is self:
+            self.deleteChild(item)
 
     def _emitDataChanged(self, key=None):
         if self.model() is not None:
-            if key is not None and key in self._items:
+            # rows of keys added after construction are not in the tree,
+            # their change is signalled on this item
+            if key is not None and key in self._items and self._items[key]._parent is self:
                 index_tl = self._items[key].index()
                 index_br = self._items[key].index(1)
             else:
@@ -423,22 +604,30 @@ class ImageFileModelItem(KeyValueModelItem):
             del fileinfo['annotations']
         hidden = ['filename']
         KeyValueModelItem.__init__(self, hidden=hidden, properties=fileinfo)
-        self._toload = []
-        for ann in self._annotation_data:
-            self._children.append(ann)
-            self._toload.append(ann)
-        self._loaded = False
+        self._children.extend(self._annotation_data)
+        self._setUnloaded(len(self._annotation_data))
+        self._revision = 0
+        self._savedRevision = 0
 
-    def _load(self, index):
-        self._toload.remove(self._children[index])
-        ann = AnnotationModelItem(self._children[index])
-        self.replaceChild(index, ann)
-        if len(self._toload) == 0:
-            self._loaded = True
+    def _createChild(self, ann):
+        return AnnotationModelItem(ann)
 
     def setSeen(self):
         self._seen = True
 
+    def revision(self):
+        return self._revision
+
+    def isDirty(self):
+        return self._revision != self._savedRevision
+
+    def setChanged(self):
+        self._revision += 1
+
+    def setSaved(self, revision):
+        # revision is the one that was uploaded, later edits stay dirty
+        self._savedRevision = max(self._savedRevision, revision)
+
     def data(self, role=Qt.DisplayRole, column=0):
         if role == DataRole:
             return self._dict
@@ -496,16 +685,18 @@ class AnnotationModel(QAbstractItemModel):
     # signals
     dirtyChanged = pyqtSignal(bool, name='dirtyChanged')
 
-    def __init__(self, annotations, parent=None):
+    def __init__(self, annotations, parent=None, caseId=None):
         QAbstractItemModel.__init__(self, parent)
 
         self._annotations = annotations
+        self._caseId = caseId
         self._dirty = False
+        self._appending = False
         self._root = RootModelItem(self, annotations)
 
         self.dataChanged.connect(self.onDataChanged)
-        self.rowsInserted.connect(self.onDataChanged)
-        self.rowsRemoved.connect(self.onDataChanged)
+        self.rowsInserted.connect(self.onRowsChanged)
+        self.rowsRemoved.connect(self.onRowsChanged)
 
     # QAbstractItemModel overloads
     def hasChildren(self, index=QModelIndex()):
@@ -582,6 +773,10 @@ class AnnotationModel(QAbstractItemModel):
     def root(self):
         return self._root
 
+    def caseId(self):
+        # the case the annotations belong to, None if not loaded from the server
+        return self._caseId
+
     def dirty(self):
         return self._dirty
 
@@ -590,9 +785,58 @@ class AnnotationModel(QAbstractItemModel):
             self._dirty = dirty
             self.dirtyChanged.emit(self._dirty)
 
-    def onDataChanged(self, *args):
+    def onDataChanged(self, indexFrom, indexTo, roles=None):
+        image = self.imageFromIndex(indexFrom)
+        if image is not None:
+            image.setChanged()
+        self.setDirty()
+
+    def onRowsChanged(self, index, first, last):
+        if self._appending:
+            return
+        if not QModelIndex(index).isValid():
+            # images added to or removed from the root
+            for row in range(first, min(last + 1, self._root.rowCount())):
+                child = self._root._children[row]
+                if isinstance(child, ImageFileModelItem):
+                    child.setChanged()
+        else:
+            image = self.imageFromIndex(index)
+            if image is not None:
+                image.setChanged()
         self.setDirty()
 
+    def appendFiles(self, fileinfos):
+        """
+        Appends images loaded from the server, e.g. the later parts of a
+        case that is still arriving.  Unlike edits, this does not make the
+        model dirty.
+        """
+        self._appending = True
+        try:
+            return self._root.appendFileItems(fileinfos)
+        finally:
+            self._appending = False
+
+    def imageFromIndex(self, index):
+        """
+        Returns the image item the index belongs to, or None for the root.
+        """
+        index = QModelIndex(index)
+        if not index.isValid():
+            return None
+        item = index.internalPointer()
+        if item is self._root:
+            return self._root.childAt(index.row())
+        while item is not None and not isinstance(item, ImageFileModelItem):
+            item = item.parent()
+        return item
+
+    def dirtyImages(self):
+        # images which are not loaded yet cannot have been changed
+        return [child for child in self._root._children
+                if isinstance(child, ImageFileModelItem) and child.isDirty()]
+
     def itemFromIndex(self, index):
         index = QModelIndex(index)  # explicitly convert from QPersistentModelIndex
         if index.isValid():
@@ -673,7 +917,6 @@ class AnnotationTreeView(QTreeView):
             self.selectionModel().select(sel, QItemSelectionModel.Select)
 
     def selectionChanged(self, selected, deselected):
-        print('selectionChanged')
         items = [self.model().itemFromIndex(index) for index in self.selectionModel().selectedIndexes()]
         self.selectedItemsChanged.emit(items)
         QTreeView.selectionChanged(self, selected, deselected)
@@ -0,0 +1,276 @@
+"""
+End-to-end network benchmark against the local fake server.
+
+Measures the time from opening a case to the first and to the last image
+loaded through ``AnnotationTool.loadImage``, the latency of
+``Network.labelUpload`` for different case sizes, and the image throughput
+for different download worker counts and cache states.  Runs headless on
+the offscreen Qt platform and prints the results as JSON::
+
+    cd sloth/bin && python benchmark.py --output results.json
+"""
+import os
+import sys
+import argparse
+import contextlib
+import json
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+from os.path import dirname, realpath
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, dirname(dirname(dirname(realpath(__file__)))))
+from PyQt5.QtCore import QEventLoop, QTimer
+from PyQt5.QtWidgets import QApplication
+# keep stdout clean for the results
+with contextlib.redirect_stdout(sys.stderr):
+    from sloth.conf import config
+    from sloth.core.log import setupLogging
+    from sloth.annotations.model import AnnotationModel
+    from sloth.network.fakeserver import FakeServer
+    from sloth.gui.labeltool import MainWindow
+    from sloth import APP_NAME, ORGANIZATION_NAME, ORGANIZATION_DOMAIN
+
+CACHE_STATES = ('none', 'cold', 'warm', 'arrays')
+
+
+def intList(text):
+    return [int(v) for v in text.split(',') if v]
+
+
+def summary(values):
+    values = [v for v in values if v is not None]
+    if not values:
+        return None
+    return {'median': statistics.median(values), 'min': min(values),
+            'max': max(values), 'runs': len(values)}
+
+
+class Benchmark:
+    def __init__(self, args, workdir):
+        self.args = args
+        self.workdir = workdir
+        self.quiet = open(os.devnull, 'w')
+        self._case = 0
+
+    def server(self, images):
+        args = self.args
+        width, height = (int(v) for v in args.image_size.lower().split('x'))
+        server = FakeServer(latency=args.latency, jitter=args.jitter,
+                            bandwidth=args.bandwidth, errorRate=args.error_rate,
+                            cases=10000, images=images, imageSize=(width, height),
+                            polygons=args.polygons, points=args.points,
+                            format=args.format)
+        server.start()
+        return server
+
+    def window(self, server, workers, cacheState):
+        config.SERVER_URL = server.url
+        config.DOWNLOAD_WORKERS = workers
+        config.AUTOSAVE = False
+        config.POLYGON_ENCODING = self.args.polygon_encoding
+        config.UPLOAD_JOURNAL = os.path.join(self.workdir, 'uploads.journal')
+        cacheDir = os.path.join(self.workdir, 'cache-%d' % workers)
+        if cacheState in ('none', 'cold') and os.path.exists(cacheDir):
+            shutil.rmtree(cacheDir)
+        config.IMAGE_CACHE_DIR = '' if cacheState == 'none' else cacheDir
+        config.IMAGE_ARRAY_CACHE_SIZE = config.IMAGE_CACHE_SIZE if cacheState == 'arrays' else 0
+        window = MainWindow(None)
+        window.network.loginDataProcess({'username': 'benchmark', 'password': '', 'validateCode': ''})
+        return window
+
+    def nextCase(self):
+        self._case += 1
+        return self._case
+
+    def openCase(self, window, case):
+        """
+        Opens ``case`` and waits until all its images are loaded.  Returns
+        the seconds to the first records of the case, the end of the case
+        detail, the first and the last image.
+        """
+        tool = window.tool
+        loop = QEventLoop()
+        marks = {}
+
+        def onStateChanged():
+            loaded, failed, total = tool.downloadState()
+            now = time.perf_counter() - start
+            if loaded and 'first' not in marks:
+                marks['first'] = now
+            if 'detail' in marks and loaded == total and 'all' not in marks:
+                marks['all'] = now
+                loop.quit()
+
+        def onCaseLoaded(count):
+            marks['detail'] = time.perf_counter() - start
+            onStateChanged()
+
+        start = time.perf_counter()
+        tool.downloadStateChanged.connect(onStateChanged)
+        job = tool.openCase({'dataDetailId': case})
+        job.resultReady.connect(lambda records: marks.setdefault('firstRecords', time.perf_counter() - start))
+        job.finished.connect(onCaseLoaded)
+        job.failed.connect(loop.quit)
+        timer = QTimer()
+        timer.setSingleShot(True)
+        timer.timeout.connect(loop.quit)
+        timer.start(int(self.args.timeout * 1000))
+        if 'all' not in marks:
+            loop.exec_()
+        timer.stop()
+        tool.downloadStateChanged.disconnect(onStateChanged)
+        return marks
+
+    def close(self, window):
+        window.tool.clearAnnotations()
+        window.prefetcher.cancel()
+        # no job of this window may outlive it or reach the next server
+        window.network.jobs.cancelAll()
+        window.network.jobs.waitForDone()
+        window.tool.downloader.waitForDone()
+        window.prefetcher.waitForDone()
+        QApplication.processEvents()
+        window.network.pool.clear()
+        if window.network.journal is not None:
+            window.network.journal.close()
+        window.deleteLater()
+        QApplication.processEvents()
+
+    def caseBytes(self, server, case):
+        images = server.data.images
+        return sum(len(server.data.pic(server.data.picId(case, i))) for i in range(images))
+
+    def runOpen(self):
+        results = []
+        for images in self.args.images:
+            server = self.server(images)
+            window = self.window(server, self.args.workers[-1], 'none')
+            runs = [self.openCase(window, self.nextCase()) for _ in range(self.args.repeat)]
+            self.close(window)
+            server.stop()
+            results.append({'images': images,
+                            'firstRecords': summary([r.get('firstRecords') for r in runs]),
+                            'detail': summary([r.get('detail') for r in runs]),
+                            'firstImage': summary([r.get('first') for r in runs]),
+                            'allImages': summary([r.get('all') for r in runs]),
+                            'timeouts': sum(1 for r in runs if 'all' not in r)})
+        return results
+
+    def runSave(self):
+        results = []
+        for images in self.args.images:
+            server = self.server(images)
+            window = self.window(server, self.args.workers[-1], 'none')
+            case = self.nextCase()
+            # the labels as the tool would send them, without the downloads
+            model = AnnotationModel(window.network.caseDetailDataProcess({'dataDetailId': case}))
+            annotations = model.root().getAnnotations()
+            before = window.network.transferStats()
+            latencies = []
+            for _ in range(self.args.repeat):
+                start = time.perf_counter()
+                window.network.labelUpload(annotations, isSubmit=False, caseId=case)
+                latencies.append(time.perf_counter() - start)
+            after = window.network.transferStats()
+            self.close(window)
+            server.stop()
+            requests = max(1, after['requests'] - before['requests'])
+            results.append({'images': images,
+                            'polygons': images * self.args.polygons,
+                            'latency': summary(latencies),
+                            'bytesPerRequest': (after['sent'] - before['sent']) // requests})
+        return results
+
+    def runThroughput(self):
+        results = []
+        images = self.args.throughput_images
+        server = self.server(images)
+        for workers in self.args.workers:
+            for cacheState in self.args.cache_states:
+                case = self.nextCase()
+                if cacheState in ('warm', 'arrays'):
+                    # fill the cache first
+                    window = self.window(server, workers, 'cold' if cacheState == 'warm' else 'arrays')
+                    self.openCase(window, case)
+                    self.close(window)
+                window = self.window(server, workers, cacheState)
+                marks = self.openCase(window, case)
+                self.close(window)
+                seconds = marks.get('all')
+                size = self.caseBytes(server, case)
+                entry = {'workers': workers, 'cache': cacheState, 'images': images,
+                         'bytes': size, 'seconds': seconds, 'mbPerSecond': None,
+                         'imagesPerSecond': None}
+                if seconds:
+                    entry['mbPerSecond'] = size / seconds / 1e6
+                    entry['imagesPerSecond'] = images / seconds
+                results.append(entry)
+        server.stop()
+        return results
+
+    def run(self):
+        results = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'python': platform.python_version(),
+                   'settings': {key: value for key, value in vars(self.args).items()
+                                if key != 'output'}}
+        with contextlib.redirect_stdout(self.quiet):
+            if 'open' in self.args.suites:
+                results['open'] = self.runOpen()
+            if 'save' in self.args.suites:
+                results['save'] = self.runSave()
+            if 'throughput' in self.args.suites:
+                results['throughput'] = self.runThroughput()
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end network benchmark.')
+    parser.add_argument('--suites', default='open,save,throughput',
+                        help='comma separated subset of open, save, throughput')
+    parser.add_argument('--images', type=intList, default=[10, 50],
+                        help='case sizes for the open and save suites')
+    parser.add_argument('--throughput-images', type=int, default=40)
+    parser.add_argument('--workers', type=intList, default=[1, 2, 4, 8])
+    parser.add_argument('--cache-states', default=','.join(CACHE_STATES),
+                        help='comma separated subset of %s' % ', '.join(CACHE_STATES))
+    parser.add_argument('--image-size', default='1024x1024', help='WIDTHxHEIGHT')
+    parser.add_argument('--format', default='JPEG', choices=('JPEG', 'PNG'))
+    parser.add_argument('--polygons', type=int, default=4, help='polygons per image')
+    parser.add_argument('--points', type=int, default=64, help='points per polygon')
+    parser.add_argument('--polygon-encoding', default='compact', choices=('text', 'compact'))
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds per request')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--bandwidth', type=int, default=0, help='bytes per second, 0 for unlimited')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--timeout', type=float, default=120.0, help='seconds per case open')
+    parser.add_argument('--output', help='write the results to this file instead of stdout')
+    parser.add_argument('--log-level', default='ERROR', help='level of the messages logged to stderr')
+    args, qtargs = parser.parse_known_args()
+    args.suites = [s for s in args.suites.split(',') if s]
+    args.cache_states = [s for s in args.cache_states.split(',') if s]
+    setupLogging(config, args.log_level)
+
+    app = QApplication(sys.argv[:1] + qtargs)
+    app.setOrganizationName(ORGANIZATION_NAME)
+    app.setOrganizationDomain(ORGANIZATION_DOMAIN)
+    app.setApplicationName(APP_NAME + '-benchmark')
+
+    workdir = tempfile.mkdtemp(prefix='sloth-benchmark-')
+    try:
+        results = Benchmark(args, workdir).run()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    text = json.dumps(results, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,27 @@
 import sys
+import argparse
 from os.path import dirname, realpath
 sys.path.insert(0, dirname(dirname(dirname(realpath(__file__)))))
 from PyQt5.QtWidgets import QApplication
 from sloth.core.labeltool import LabelTool
+from sloth.conf import config
+from sloth.core.log import setupLogging
 from sloth import APP_NAME, ORGANIZATION_NAME, ORGANIZATION_DOMAIN
 
 
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
+    parser = argparse.ArgumentParser(prog=APP_NAME)
+    parser.add_argument('--server', help='base URL of the annotation server API')
+    parser.add_argument('--log-level', help='overrides LOG_LEVEL, e.g. DEBUG')
+    args, qtargs = parser.parse_known_args()
+    setupLogging(config, args.log_level)
+    if args.server:
+        config.SERVER_URL = args.server if args.server.endswith('/') else args.server + '/'
+
+    app = QApplication(sys.argv[:1] + qtargs)
     app.setOrganizationName(ORGANIZATION_NAME)
     app.setOrganizationDomain(ORGANIZATION_DOMAIN)
     app.setApplicationName(APP_NAME)
 
     labeltool = LabelTool()
-    sys.exit(app.exec_())
\ No newline at end of file
+    sys.exit(app.exec_())
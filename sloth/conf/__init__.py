@@ -1,10 +1,12 @@
 import os
 import sys
 import importlib
+import logging
 from sloth.conf import default_config
 import json
 
-print(os.getcwd())
+LOG = logging.getLogger(__name__)
+LOG.debug("Loading configuration relative to %s", os.getcwd())
 
 f = open("../conf/tojson.json", 'r')
 f = json.load(f)
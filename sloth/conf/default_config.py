@@ -9,6 +9,8 @@
 # to specify a module path (as string) pointing to such a python callable.
 # It will then be automatically imported.
 
+import os
+
 # LABELS
 #
 # List/tuple of dictionaries that defines the label classes
@@ -161,3 +163,188 @@ HOTKEYS = (
     ('Shift+c',   lambda lt: lt.currentImage().confirmAll(), 'Mark all annotations in image as confirmed'),
 )
 
+
+# SERVER_URL
+#
+# Base URL of the annotation server API.  Can be overridden on the command
+# line with --server, e.g. to use the local stand-in server in
+# sloth.network.fakeserver.
+
+SERVER_URL = 'http://115.159.237.230:8086/mrtApi/'
+
+# NETWORK
+#
+# Settings of the keep-alive connection pool used for all requests to the
+# annotation server.
+#
+#   - NETWORK_POOL_SIZE : maximum number of idle connections kept open.
+#
+#   - NETWORK_POOL_PER_HOST : maximum number of simultaneous connections
+#                             to a single host.
+#
+#   - NETWORK_POOL_IDLE_TIMEOUT : seconds after which an idle connection
+#                                 is closed instead of reused.
+#
+#   - NETWORK_TIMEOUT : socket timeout in seconds (None blocks forever).
+
+NETWORK_POOL_SIZE = 8
+NETWORK_POOL_PER_HOST = 6
+NETWORK_POOL_IDLE_TIMEOUT = 30.0
+NETWORK_TIMEOUT = 30.0
+
+# DOWNLOAD_WORKERS
+#
+# Number of worker threads downloading the images of a case.  Pending
+# downloads wait in a queue until a worker is free.
+#
+# DOWNLOAD_NOTIFY_INTERVAL
+#
+# Milliseconds over which completed downloads are collected before the
+# annotation tree and the status bar are updated, so they repaint at most
+# once per frame.
+
+DOWNLOAD_WORKERS = 4
+DOWNLOAD_NOTIFY_INTERVAL = 16
+
+# DOWNLOAD_PREVIEW_SIZE
+#
+# While the scene waits for a large JPEG picture, it is first decoded at a
+# reduced resolution of at least this many pixels on the longer side and
+# shown as a preview until the full resolution is ready.  Other pictures are
+# not decoded twice.  0 disables previews.
+
+DOWNLOAD_PREVIEW_SIZE = 1024
+
+# IMAGE_CACHE_DIR, IMAGE_CACHE_SIZE
+#
+# Downloaded images are kept in a local cache directory and verified
+# against the md5 sent by the server, so reopening a case does not
+# download its images again.  The least recently used images are removed
+# once the cache grows beyond IMAGE_CACHE_SIZE bytes.  Set
+# IMAGE_CACHE_DIR to None to disable the cache.
+
+IMAGE_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.sloth', 'cache')
+IMAGE_CACHE_SIZE = 2 * 1024 ** 3
+
+# IMAGE_ARRAY_CACHE_SIZE
+#
+# Optional second cache tier below IMAGE_CACHE_DIR that keeps decoded
+# pixel arrays as memory-mapped .npy files, so reopened images skip
+# decoding entirely.  Size in bytes; 0 disables it.
+
+IMAGE_ARRAY_CACHE_SIZE = 0
+
+# NETWORK_JOB_THREADS
+#
+# Number of threads running case list, case detail and upload requests in
+# the background.
+
+NETWORK_JOB_THREADS = 2
+
+# AUTOSAVE
+#
+# Save the annotations in the background once no edit has been made for
+# AUTOSAVE_DELAY milliseconds.  While editing continuously, a save is
+# started at the latest AUTOSAVE_MAX_DELAY milliseconds after the first
+# unsaved edit.  After a failed save the next attempt is delayed twice as
+# long each time, up to AUTOSAVE_MAX_BACKOFF milliseconds.  Labels the server
+# rejected are saved again only after the next edit.
+
+AUTOSAVE = True
+AUTOSAVE_DELAY = 3000
+AUTOSAVE_MAX_DELAY = 30000
+AUTOSAVE_MAX_BACKOFF = 300000
+
+# UPLOAD_JOURNAL
+#
+# Path of the local journal of label uploads.  Uploads are written to the
+# journal before they are sent; if the server cannot be reached they stay
+# there and are replayed in order every UPLOAD_JOURNAL_REPLAY_INTERVAL
+# milliseconds.  The journal is fsync'ed every UPLOAD_JOURNAL_SYNC_EVERY
+# records.  Set to None to upload without a journal.
+
+UPLOAD_JOURNAL = os.path.join(os.path.expanduser('~'), '.sloth', 'uploads.journal')
+UPLOAD_JOURNAL_SYNC_EVERY = 8
+UPLOAD_JOURNAL_REPLAY_INTERVAL = 10000
+
+# DOWNLOAD_RETRIES, DOWNLOAD_TIMEOUT, DOWNLOAD_BACKOFF, DOWNLOAD_BACKOFF_MAX
+#
+# A failed image download is retried up to DOWNLOAD_RETRIES times after a
+# random delay of up to DOWNLOAD_BACKOFF * 2^n seconds (at most
+# DOWNLOAD_BACKOFF_MAX), resuming where the previous attempt stopped.
+# DOWNLOAD_TIMEOUT is the socket timeout of a download in seconds.
+# Images which still fail are queued again after DOWNLOAD_REQUEUE_DELAY
+# milliseconds, doubling with every further failure.
+
+DOWNLOAD_RETRIES = 4
+DOWNLOAD_TIMEOUT = 20.0
+DOWNLOAD_BACKOFF = 0.5
+DOWNLOAD_BACKOFF_MAX = 8.0
+DOWNLOAD_REQUEUE_DELAY = 5000
+
+# NETWORK_COMPRESS_UPLOADS
+#
+# Send large request bodies (label uploads) gzip compressed.  Only enable
+# this if the server accepts Content-Encoding: gzip; if it answers with
+# 415 or 400, uploads fall back to uncompressed bodies.  Responses are
+# always requested with Accept-Encoding: gzip, deflate.
+
+NETWORK_COMPRESS_UPLOADS = False
+
+# POLYGON_ENCODING
+#
+# Encoding of polygon coordinates in the labels, see sloth.annotations.codec.
+# With 'compact', the client offers the compact binary encoding at login
+# and uses it if the server accepts it; 'text' always sends the ';'-joined
+# decimal strings in xn/yn.  Both encodings are understood when loading.
+
+POLYGON_ENCODING = 'compact'
+
+# CASE_LIST_PAGE_SIZE, CASE_LIST_CACHE_TTL
+#
+# The case list is fetched CASE_LIST_PAGE_SIZE cases at a time while it is
+# scrolled, prefetching the next page in the background.  Fetched pages are
+# reused for CASE_LIST_CACHE_TTL seconds.
+
+CASE_LIST_PAGE_SIZE = 50
+CASE_LIST_CACHE_TTL = 300
+
+# PREFETCH_NEXT_CASE
+#
+# While a case is open, fetch the details and images of the case following
+# it in the case list into the caches, so opening it next is near-instant.
+# Images are prefetched by PREFETCH_WORKERS threads, and only once all
+# images of the current case are downloaded.  Prefetched case details are
+# used for PREFETCH_TTL seconds.
+
+PREFETCH_NEXT_CASE = False
+PREFETCH_WORKERS = 1
+PREFETCH_TTL = 600
+
+# NETWORK_TRACE
+#
+# Record the timings (name lookup, connect, time to first byte, transfer),
+# byte counts, status and retries of every request to the server, with
+# latency percentiles per endpoint.  They are shown in the Network dock
+# (Views menu), which can also dump them to JSON.  The last
+# NETWORK_TRACE_KEEP requests are kept individually.
+
+NETWORK_TRACE = True
+NETWORK_TRACE_KEEP = 200
+
+# LOG_LEVEL
+#
+# Level of the messages logged by sloth: 'DEBUG', 'INFO', 'WARNING' or
+# 'ERROR'.  LOG_LEVELS sets the level of single subsystems, e.g.
+# {'sloth.network': 'DEBUG'} to see every request, or
+# {'sloth.annotations': 'ERROR'}.
+#
+# Messages go to stderr, and to LOG_FILE too if set.  The file is rotated
+# once it exceeds LOG_FILE_MAX_BYTES, keeping LOG_FILE_BACKUPS old files.
+
+LOG_LEVEL = 'WARNING'
+LOG_LEVELS = {}
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+LOG_FILE = None
+LOG_FILE_MAX_BYTES = 10 * 1024 * 1024
+LOG_FILE_BACKUPS = 3
@@ -16,3 +16,15 @@ class NotImplementedException(Exception):
 class InvalidArgumentException(Exception):
     """The argument is invalid."""
     pass
+
+
+class NetworkError(Exception):
+    """The server could not be reached or answered with an error."""
+    def __init__(self, message, status=None):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class JobCancelled(Exception):
+    """The background job has been cancelled."""
+    pass
@@ -0,0 +1,53 @@
+"""
+Logging setup.
+
+Modules log through ``LOG = logging.getLogger(__name__)`` with the message
+arguments passed separately (``LOG.debug("loaded %s", item)``), so nothing
+is formatted for disabled levels.  The levels are set per subsystem from
+the configuration, see ``LOG_LEVEL`` and ``LOG_LEVELS``.
+"""
+import logging
+import logging.handlers
+
+
+def setupLogging(config, level=None):
+    """
+    Configures the ``sloth`` loggers from ``config``.  ``level`` overrides
+    ``LOG_LEVEL``, e.g. from the command line.
+    """
+    root = logging.getLogger('sloth')
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    root.propagate = False
+    root.setLevel(_level(level or config.LOG_LEVEL))
+
+    formatter = logging.Formatter(config.LOG_FORMAT)
+    console = logging.StreamHandler()
+    console.setFormatter(formatter)
+    root.addHandler(console)
+
+    if config.LOG_FILE:
+        try:
+            sink = logging.handlers.RotatingFileHandler(config.LOG_FILE,
+                                                        maxBytes=config.LOG_FILE_MAX_BYTES,
+                                                        backupCount=config.LOG_FILE_BACKUPS,
+                                                        encoding='utf-8')
+        except OSError as e:
+            root.error("Could not open log file %s (%s)", config.LOG_FILE, e)
+        else:
+            sink.setFormatter(formatter)
+            root.addHandler(sink)
+
+    for name, value in config.LOG_LEVELS.items():
+        logging.getLogger(name).setLevel(_level(value))
+    return root
+
+
+def _level(value):
+    if isinstance(value, int):
+        return value
+    level = logging.getLevelName(str(value).upper())
+    if not isinstance(level, int):
+        raise ValueError('unknown log level %r' % value)
+    return level
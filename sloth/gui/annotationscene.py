@@ -4,6 +4,9 @@ from PyQt5.QtGui import *
 from sloth.gui.logindl import toQImage
 from sloth.annotations.model import *
 from sloth.items import *
+import logging
+
+LOG = logging.getLogger(__name__)
 
 class AnnotationScene(QGraphicsScene):
 
@@ -15,6 +18,7 @@ class AnnotationScene(QGraphicsScene):
         self._itemFactory = Factory(items)
         self._inserterFactory = Factory(inserters)
         self._inserter =None
+        self._waiting = None
         self.reset()
 
     def setModel(self, model):
@@ -45,41 +49,63 @@ class AnnotationScene(QGraphicsScene):
     def setCurrentImage(self, current_image=None):
         if current_image == self._image_item:
             return
+        self.stopWaiting()
+        self.clear()
+        self._image_item = current_image
+        self._image = None
+        self._pixmap = None
         if current_image is None:
-            self.clear()
-            self._image_item = None
-            self._image = None
-            self._pixmap = None
-        else:
-            self.clear()
-            self._image_item = current_image
-            image = self.tool.getImage(current_image)
-            if image.isLoaded():
-                self._image = image.getImage()
-                self._opaque = 0.6
-                self._image_item._sceen = True
-                self._pixmap = QPixmap(toQImage(self._image))
-                self._scene_item = QGraphicsPixmapItem(self._pixmap)
-                self._scene_item.setZValue(-1)
-                self.setSceneRect(0, 0, self._pixmap.width(), self._pixmap.height())
-                self.addItem(self._scene_item)
-                self.insertItems(0, len(self._image_item.children()) - 1)
-                self.update()
-            else:
-                image.imageLoaded.connect(self.waitForImage)
+            return
+        image = self.tool.getImage(current_image)
+        if image.isLoaded():
+            self.showImage(image.getImage())
+            return
+        if image.preview is not None:
+            self.showImage(*image.preview)
+        self._waiting = image
+        image.setPreviewWanted(True)
+        image.previewLoaded.connect(self.waitForPreview)
+        image.imageLoaded.connect(self.waitForImage)
+
+    def stopWaiting(self):
+        if self._waiting is not None:
+            self._waiting.setPreviewWanted(False)
+            self._waiting.previewLoaded.disconnect(self.waitForPreview)
+            self._waiting.imageLoaded.disconnect(self.waitForImage)
+            self._waiting = None
+
+    def waitForPreview(self):
+        self.showImage(*self._waiting.preview)
 
     def waitForImage(self):
-        image = self.tool.getImage(self._image_item)
-        image.imageLoaded.disconnect(self.waitForImage)
-        self._image = image.getImage()
-        self._opaque = 0.6
-        self._image_item._sceen = True
-        self._pixmap = QPixmap(toQImage(self._image))
-        self._scene_item = QGraphicsPixmapItem(self._pixmap)
-        self._scene_item.setZValue(-1)
-        self.setSceneRect(0, 0, self._pixmap.width(), self._pixmap.height())
-        self.addItem(self._scene_item)
-        self.insertItems(0, len(self._image_item.children()) - 1)
+        image = self._waiting
+        self.stopWaiting()
+        self.showImage(image.getImage())
+
+    def showImage(self, pic, size=None):
+        """
+        Shows ``pic`` behind the annotations of the current image.  A
+        preview is stretched to the full ``size`` (width, height) of the
+        image, so the scene keeps the coordinates of the full resolution and
+        the annotation items stay in place when the pixmap is swapped.
+        """
+        self._image = pic
+        self._pixmap = QPixmap(toQImage(pic))
+        if size is None:
+            size = (self._pixmap.width(), self._pixmap.height())
+        if self._scene_item is None:
+            self._opaque = 0.6
+            self._image_item._sceen = True
+            self._scene_item = QGraphicsPixmapItem(self._pixmap)
+            self._scene_item.setZValue(-1)
+            self._scene_item.setTransformationMode(Qt.SmoothTransformation)
+            self.setSceneRect(0, 0, size[0], size[1])
+            self.addItem(self._scene_item)
+            self.insertItems(0, len(self._image_item.children()) - 1)
+        else:
+            self._scene_item.setPixmap(self._pixmap)
+        self._scene_item.setTransform(QTransform.fromScale(size[0] / max(1, self._pixmap.width()),
+                                                           size[1] / max(1, self._pixmap.height())))
         self.update()
 
     def insertItems(self, first, last):
@@ -96,7 +122,7 @@ class AnnotationScene(QGraphicsScene):
             try:
                 label_class = child['class']
             except KeyError:
-                print('keyerror there is no class key item')
+                LOG.warning("Annotation without class key: %s", child)
                 continue
             item = self._itemFactory.create(label_class, child)
             if item is not None:
@@ -249,7 +275,6 @@ class AnnotationScene(QGraphicsScene):
             item.dataChanged()
 
     def rowsInserted(self, index, first, last):
-        print('rowsinserted')
         if self._image_item is None or self._image_item.index() != index:
             return
         self.insertItems(first, last)
@@ -1,20 +1,54 @@
 from PyQt5.QtCore import *
 from sloth.annotations.model import *
-from threading import Thread
-import hashlib
+from sloth.network.download import DownloadExecutor
+from sloth.network.cache import ImageCache, ArrayCache
+from sloth.network.network import decodePic, decodePreview
+from sloth.conf import config
+import logging
+import os
+from functools import partial
+
+LOG = logging.getLogger(__name__)
 
 
 class AnnotationTool(QObject):
 
     annotationsLoaded = pyqtSignal()
     currentImageChanged = pyqtSignal()
+    downloadStateChanged = pyqtSignal()
+    caseOpening = pyqtSignal(object)
+    caseDownloaded = pyqtSignal()
+    caseFailed = pyqtSignal(object)
     def __init__(self, mainwindow, network):
         QObject.__init__(self)
         self._model = AnnotationModel([])
         self._mainwindow = mainwindow
         self._currentImage = None
         self.network = self._mainwindow.network
+        # download jobs of the current case in model order, indexed by picId
         self.images = []
+        self._images = {}
+        self._loadedCount = 0
+        self._failedCount = 0
+        self._reported = False
+        self._complete = True
+        self._caseJob = None
+        self._caseId = None
+        self._caseRecords = 0
+        self.downloader = DownloadExecutor(config.DOWNLOAD_WORKERS, self)
+        # completed downloads are announced at most once per frame
+        self._loadedTimer = QTimer(self)
+        self._loadedTimer.setSingleShot(True)
+        self._loadedTimer.setInterval(config.DOWNLOAD_NOTIFY_INTERVAL)
+        self._loadedTimer.timeout.connect(self.onImagesLoaded)
+        self.cache = None
+        self.arrayCache = None
+        if config.IMAGE_CACHE_DIR:
+            self.cache = ImageCache(config.IMAGE_CACHE_DIR, config.IMAGE_CACHE_SIZE)
+            if config.IMAGE_ARRAY_CACHE_SIZE:
+                self.arrayCache = ArrayCache(os.path.join(config.IMAGE_CACHE_DIR, 'arrays'),
+                                             config.IMAGE_ARRAY_CACHE_SIZE)
+        self.currentImageChanged.connect(self.prioritiseDownloads)
 
     def model(self):
         return self._model
@@ -35,37 +69,161 @@ class AnnotationTool(QObject):
             self._mainwindow.scene.deleteSelectedItems()
 
 
-    def loadAnnotations(self, ann, handleErrors=True):
+    def openCase(self, data):
+        """
+        Loads a case from the server.  Images are added to the model and
+        downloaded while the rest of the case is still arriving.  Returns
+        the loading job.
+        """
+        if self._caseJob is not None:
+            self._caseJob.cancel()
+        self._caseRecords = 0
+        self._caseId = data['dataDetailId']
+        self.caseOpening.emit(data['dataDetailId'])
+        job = self.network.jobs.submit(self.network.streamCaseDetail, data)
+        job.resultReady.connect(self.onCaseRecords)
+        job.finished.connect(self.onCaseLoaded)
+        job.failed.connect(self.onCaseFailed)
+        self._caseJob = job
+        return job
+
+    def onCaseRecords(self, records):
+        if self._caseRecords == 0:
+            self.loadAnnotations(records, complete=False, caseId=self._caseId)
+        else:
+            self.appendAnnotations(records)
+        self._caseRecords += len(records)
+
+    def onCaseLoaded(self, count):
+        self._caseJob = None
+        if count is None:
+            return
+        if self._caseRecords == 0:
+            self.loadAnnotations([], caseId=self._caseId)
+        else:
+            self.setComplete()
+
+    def onCaseFailed(self, error):
+        # a partly loaded case stays open for editing and saving, but it
+        # is not complete and cannot be submitted
+        self._caseJob = None
+        LOG.error("Loading case %s failed (%s)", self._caseId, error)
+        self.caseFailed.emit(error)
+
+    def isComplete(self):
+        return self._complete
+
+    def loadAnnotations(self, ann, handleErrors=True, complete=True, caseId=None):
+        self._complete = complete
         try:
-            self._model = AnnotationModel(ann)
+            self._model = AnnotationModel(ann, caseId=caseId)
         except Exception as e:
             if handleErrors:
-                print("Error: Loading failed (%s)" % str(e))
+                LOG.error("Loading failed (%s)", e)
             else:
                 raise
         self.annotationsLoaded.emit()
         self.loadImage()
 
+    def appendAnnotations(self, ann):
+        """
+        Adds images to the current case while it is loading.
+        """
+        items = self._model.appendFiles(ann)
+        self.startDownloads(items)
+
+    def setComplete(self):
+        """
+        Marks the current case as completely loaded.
+        """
+        self._complete = True
+        self.checkAllLoaded()
+
     def loadImage(self):
-        for item in self._model.iterator(ImageFileModelItem):
-            image = ImageThread(item, self.network)
-            image.start()
-            image.imageLoaded.connect(self.onImageLoaded)
+        self.downloader.cancelAll()
+        self._loadedTimer.stop()
+        self.resetImages()
+        self.startDownloads(self._model.iterator(ImageFileModelItem))
+
+    def resetImages(self):
+        self.images = []
+        self._images = {}
+        self._loadedCount = 0
+        self._failedCount = 0
+        self._reported = False
+
+    def startDownloads(self, items):
+        for item in items:
+            image = ImageJob(item, self.network, self.cache, self.arrayCache,
+                             config.DOWNLOAD_PREVIEW_SIZE)
+            image.imageLoaded.connect(partial(self.onImageLoaded, image))
+            image.imageFailed.connect(partial(self.onImageFailed, image))
             self.images.append(image)
+            self._images[image.picId] = image
+            self.downloader.submit(image, self.downloadPriority(image))
+        self.downloadStateChanged.emit()
+
+    def downloadPriority(self, image):
+        # current image first, then its neighbours by distance, next before previous
+        row = image.image.row()
+        if self._currentImage is None:
+            return (row, False)
+        distance = row - self._currentImage.row()
+        return (abs(distance), distance < 0)
+
+    def prioritiseDownloads(self):
+        self.downloader.reprioritise(self.downloadPriority)
+
+    def downloadState(self):
+        """
+        Returns the number of loaded images, of images whose download
+        failed and is retried, and of all images of the case.
+        """
+        return (self._loadedCount, self._failedCount, len(self.images))
+
+    def outstanding(self):
+        return len(self.images) - self._loadedCount
+
+    def onImageFailed(self, image, error):
+        if image.failures == 1:
+            self._failedCount += 1
+        # give the server some time, then queue the image again
+        self.downloadStateChanged.emit()
+        delay = config.DOWNLOAD_REQUEUE_DELAY * 2 ** min(image.failures - 1, 6)
+        QTimer.singleShot(delay, partial(self.requeueImage, image))
 
-    def onImageLoaded(self):
+    def requeueImage(self, image):
+        if image.isLoaded() or self._images.get(image.picId) is not image:
+            return
+        self.downloader.submit(image, self.downloadPriority(image))
+
+    def onImageLoaded(self, image):
+        self._loadedCount += 1
+        if image.failures:
+            self._failedCount -= 1
+        if not self._loadedTimer.isActive():
+            self._loadedTimer.start()
+
+    def onImagesLoaded(self):
         self._mainwindow.treeview.update()
-        for image in self.images:
-            if not image.isLoaded():
-                return
-        self.network.downloadSuccess()
+        self.downloadStateChanged.emit()
+        self.checkAllLoaded()
+
+    def checkAllLoaded(self):
+        if not self._complete or self.outstanding() or self._reported:
+            return
+        self._reported = True
+        job = self.network.jobs.submit(self.network.downloadSuccess, self._model.caseId())
+        job.failed.connect(self.onDownloadSuccessFailed)
+        self.caseDownloaded.emit()
+
+    def onDownloadSuccessFailed(self, error):
+        LOG.error("Reporting the downloaded case failed (%s)", error)
 
     def currentImage(self):
         return self._currentImage
 
     def setCurrentImage(self, image):
-        print('setcurrentimage')
-        print(type(image))
         if isinstance(image, QModelIndex):
             image = self._model.itemFromIndex(image)
         if isinstance(image, RootModelItem):
@@ -76,27 +234,32 @@ class AnnotationTool(QObject):
             raise RuntimeError("Tried to set current image to item that has no Image or Frame as parent!")
         if image != self._currentImage:
             self._currentImage = image
-            print('setcurrentimage emit')
+            LOG.debug("Current image changed to %s", image)
             self.currentImageChanged.emit()
-        else:
-            print('budui a')
 
     def getImage(self, item):
-        for image in self.images:
-            if image.picId == item['picId']:
-                return image
+        return self._images.get(item['picId'])
 
-    def annotations(self):
+    def annotations(self, images=None):
         if self._model is None:
             return None
-        return self._model.root().getAnnotations()
+        if images is None:
+            return self._model.root().getAnnotations()
+        return [image.getAnnotations() for image in images]
 
     def clearAnnotations(self):
+        if self._caseJob is not None:
+            self._caseJob.cancel()
+            self._caseJob = None
+        self._complete = True
+        self.downloader.cancelAll()
+        self._loadedTimer.stop()
+        self.resetImages()
         self._model = AnnotationModel([])
         self.annotationsLoaded.emit()
+        self.downloadStateChanged.emit()
 
     def gotoNext(self):
-        print('gotonext')
         step = 1
         if self._model is not None:
             if self._currentImage is not None:
@@ -107,7 +270,6 @@ class AnnotationTool(QObject):
                 self.setCurrentImage(next_image)
 
     def gotoPrevious(self):
-        print('gotoprevious')
         step = 1
         if self._model is not None and self._currentImage is not None:
             prev_image = self._currentImage.getPreviousSibling(step)
@@ -126,65 +288,96 @@ class AnnotationTool(QObject):
         if next_image is not None:
             self.setCurrentImage(next_image)
 
-class ImageThread(Thread, QObject):
+class ImageJob(QObject):
     imageLoaded = pyqtSignal()
-    def __init__(self, image, network):
-        Thread.__init__(self)
+    imageFailed = pyqtSignal(object)
+    previewLoaded = pyqtSignal()
+
+    _previewReady = pyqtSignal(object)
+
+    def __init__(self, image, network, cache=None, arrayCache=None, previewSize=0):
         QObject.__init__(self)
         self.image = image
         self.picId = image['picId']
         self.network = network
+        self.cache = cache
+        self.arrayCache = arrayCache
+        self.previewSize = previewSize
         self._isLoaded = False
         self.pic = None
-        self.wrongFlag = 0
+        # (array, full size) of a reduced resolution version, until loaded;
+        # only decoded while the scene waits for this picture
+        self.preview = None
+        self._previewWanted = False
+        self.failures = 0
+        self._previewReady.connect(self._onPreviewReady, Qt.QueuedConnection)
 
     def getImage(self):
         return self.pic
 
-    # def md5Validate(self, pic):
-    #     myhash = hashlib.md5
-    #     while True:
-    #         b = pic.read(8096)
-    #         if not b:
-    #             break
-    #         myhash.update(b)
-    #     hex = myhash.hexdigest()
-    #     return hex == self.image['md5']
-
-    # def run(self):
-    #     print('start download', self.picId)
-    #     (pic, hex) = self.network.downloadPic(self.picId)
-    #     while True:
-    #         if hex == 0:
-    #             self.pic = pic
-    #             self._isLoaded = True
-    #             self.imageLoaded.emit()
-    #             self.image.setSeen()
-    #             print('download done', self.picId)
-    #             return
-    #         else:
-    #             print('pic wrong')
-    #             self.wrongFlag += 1
-    #             if self.wrongFlag >= 3:
-    #                 return
-
     def run(self):
-        self.wrongFlag = 0
-        while True:
-            (pic, hex) = self.network.downloadPic(self.picId)
-            if True:
-                print(hex)
-                print(self.image['md5'])
-                self.pic = pic
-                self._isLoaded = True
-                self.imageLoaded.emit()
-                self.image.setSeen()
-                return
-            else:
-                self.wrongFlag += 1
-                if self.wrongFlag >= 3:
-                    return
+        # called on a download worker thread
+        if self.arrayCache is not None:
+            pic = self.arrayCache.get(self.picId, self.image['md5'])
+            if pic is not None:
+                return pic
+        if self.cache is not None:
+            data = self.cache.get(self.picId, self.image['md5'])
+            if data is not None:
+                self.decodePreview(data)
+                return self.decode(data)
+        for attempt in range(3):
+            (data, hex) = self.network.fetchPic(self.picId)
+            if hex == self.image['md5']:
+                self.decodePreview(data)
+                if self.cache is not None:
+                    self.cache.put(self.picId, hex, data)
+                return self.decode(data)
+            LOG.warning("Picture %s failed md5 verification", self.picId)
+        raise RuntimeError('picture %s failed md5 verification' % self.picId)
+
+    def setPreviewWanted(self, wanted):
+        self._previewWanted = wanted
+
+    def decodePreview(self, data):
+        # shown by the scene while the full resolution is decoded
+        if not self.previewSize or not self._previewWanted:
+            return
+        try:
+            preview = decodePreview(data, self.previewSize)
+        except (OSError, ValueError) as e:
+            LOG.debug("No preview of picture %s (%s)", self.picId, e)
+            return
+        if preview is not None:
+            self._previewReady.emit(preview)
+
+    def _onPreviewReady(self, preview):
+        if not self._isLoaded:
+            self.preview = preview
+            self.previewLoaded.emit()
+
+    def decode(self, data):
+        pic = decodePic(data)
+        if self.arrayCache is not None and self.arrayCache.put(self.picId, self.image['md5'], pic):
+            # prefer the memory-mapped copy; it may already have been evicted
+            cached = self.arrayCache.get(self.picId, self.image['md5'])
+            if cached is not None:
+                pic = cached
+        return pic
+
+    def finished(self, pic):
+        # the read-only array is owned by this job from now on, the scene
+        # shows it through a QImage pointing into it
+        self.pic = pic
+        self.preview = None
+        self._isLoaded = True
+        self.image.setSeen()
+        self.imageLoaded.emit()
 
+    def failed(self, error):
+        LOG.error("Downloading picture %s failed (%s)", self.picId, error)
+        self.failures += 1
+        self.imageFailed.emit(error)
 
     def isLoaded(self):
         return self._isLoaded
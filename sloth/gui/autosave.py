@@ -0,0 +1,117 @@
+from PyQt5.QtCore import *
+
+
+class AutosaveService(QObject):
+    """
+    Saves the annotations in the background once the user stopped editing.
+
+    Every edit restarts a ``delay`` ms timer, so a burst of edits results in
+    a single upload.  During continuous editing a save is forced at the
+    latest ``maxDelay`` ms after the first unsaved edit.  Uploads go through
+    :meth:`MainWindow.requestUpload`, which never runs more than one upload
+    at a time.
+
+    After a failed upload the next attempt is delayed exponentially, up to
+    ``maxBackoff`` ms.  Labels the server rejected are not sent again until
+    the user edits them.
+    """
+
+    def __init__(self, mainwindow, delay=3000, maxDelay=30000, maxBackoff=300000, parent=None):
+        QObject.__init__(self, parent)
+        self._mainwindow = mainwindow
+        self._tool = mainwindow.tool
+        self._model = None
+        self._delay = delay
+        self._maxDelay = maxDelay
+        self._maxBackoff = maxBackoff
+        self._failures = 0
+        self._enabled = True
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self.save)
+        self._pendingSince = QElapsedTimer()
+        self._showsPending = False
+        self._tool.annotationsLoaded.connect(self.attach)
+        self.attach()
+
+    def isEnabled(self):
+        return self._enabled
+
+    def setEnabled(self, enabled):
+        self._enabled = enabled
+        if not enabled:
+            self.cancel()
+
+    def attach(self):
+        if self._model is not None:
+            try:
+                self._model.dirtyChanged.disconnect(self.onDirtyChanged)
+                self._model.dataChanged.disconnect(self.onEdited)
+                self._model.rowsInserted.disconnect(self.onEdited)
+                self._model.rowsRemoved.disconnect(self.onEdited)
+            except TypeError:
+                pass
+        self.cancel()
+        self._failures = 0
+        self._model = self._tool.model()
+        self._model.dirtyChanged.connect(self.onDirtyChanged)
+        self._model.dataChanged.connect(self.onEdited)
+        self._model.rowsInserted.connect(self.onEdited)
+        self._model.rowsRemoved.connect(self.onEdited)
+
+    def cancel(self):
+        self._timer.stop()
+        self._pendingSince.invalidate()
+        self.clearPending()
+
+    def clearPending(self):
+        # only clears the status this service set, not that of an upload
+        if self._showsPending:
+            self._showsPending = False
+            self._mainwindow.setSaveStatus('')
+
+    def onDirtyChanged(self, dirty):
+        if dirty:
+            self.onEdited()
+        else:
+            self.cancel()
+
+    def onEdited(self, *args):
+        # rows added while a case is streamed in do not make the model dirty
+        if not self._enabled or not self._mainwindow.network.isLogin() or not self._model.dirty():
+            return
+        if self._failures:
+            # edits do not bring the retry of a failed upload forward
+            if not self._timer.isActive():
+                self._timer.start(self.retryDelay())
+        else:
+            if not self._pendingSince.isValid():
+                self._pendingSince.start()
+            remaining = self._maxDelay - self._pendingSince.elapsed()
+            self._timer.start(max(0, min(self._delay, remaining)))
+        self._mainwindow.setSaveStatus('Autosave pending')
+        self._showsPending = True
+
+    def save(self):
+        self._pendingSince.invalidate()
+        if self._model is not self._tool.model() or not self._model.dirty():
+            self.clearPending()
+            return
+        self._mainwindow.requestUpload(isSubmit=False)
+
+    def retryDelay(self):
+        return min(self._delay * 2 ** min(self._failures, 16), self._maxBackoff)
+
+    def onUploadSucceeded(self):
+        self._failures = 0
+
+    def onUploadFailed(self, rejected):
+        # called after the model was marked dirty again, which scheduled a save
+        self.cancel()
+        if rejected:
+            # the same labels would be rejected again, wait for the next edit
+            self._failures = 0
+            return
+        self._failures += 1
+        if self._enabled and self._model.dirty():
+            self._timer.start(self.retryDelay())
@@ -2,10 +2,174 @@ from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from types import *
+from functools import partial
+import logging
+import time
 from sloth.conf import config
 
+LOG = logging.getLogger(__name__)
+
 dataSetId = config.DATASETID
 
+
+def _cancelJobs(jobs, *args):
+    for job in jobs.values():
+        job.cancel()
+    jobs.clear()
+
+
+class CaseListModel(QAbstractTableModel):
+    """
+    Table of the cases of a dataset, fetched page by page from the caseList
+    endpoint while the view scrolls down.
+
+    Nothing is fetched before the first :meth:`refresh`, which has to wait
+    for the login.  Whenever a page has been added, the next one is
+    requested in the background.  Fetched pages are cached for ``ttl``
+    seconds, so reopening the list or scrolling over prefetched pages does
+    not wait for the server.
+    """
+
+    columns = ['dataDetailId', 'recordNo', 'source', 'addTime']
+
+    # signals
+    loadFailed = pyqtSignal(object)
+
+    def __init__(self, network, dataSetId, pageSize=50, ttl=300, parent=None):
+        QAbstractTableModel.__init__(self, parent)
+        self.network = network
+        self.dataSetId = dataSetId
+        self.pageSize = pageSize
+        self.ttl = ttl
+        self._rows = []
+        self._active = False
+        self._exhausted = False
+        self._cache = {}
+        self._jobs = {}
+        self._wanted = None
+        # the page jobs must not call back into a deleted model
+        self.destroyed.connect(partial(_cancelJobs, self._jobs))
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.columns)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        item = self._rows[index.row()].get(self.columns[index.column()])
+        if item is None:
+            return ''
+        return str(item)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.columns[section]
+        return str(section + 1)
+
+    def caseId(self, row):
+        return int(self._rows[row]['dataDetailId'])
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return self._active and not parent.isValid() and not self._exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent) or self._wanted is not None:
+            return
+        page = len(self._rows) // self.pageSize + 1
+        items = self.cachedPage(page)
+        if items is not None:
+            self.addPage(page, items)
+        else:
+            self._wanted = page
+            self.requestPage(page)
+
+    def refresh(self, clearCache=False):
+        """
+        Starts over with the first page, dropping the expired pages and
+        those of another user, or all pages with ``clearCache``.
+        """
+        now = time.monotonic()
+        user = self.network.name
+        self._cache = dict((key, entry) for key, entry in self._cache.items()
+                           if not clearCache and key[0] == user and now - entry[0] < self.ttl)
+        self._reset(active=True)
+        self.fetchMore()
+
+    def clear(self):
+        """
+        Empties the list until the next :meth:`refresh`, e.g. on logoff.
+        """
+        self._reset(active=False)
+
+    def _reset(self, active):
+        # pages still being fetched belong to the old list
+        _cancelJobs(self._jobs)
+        self.beginResetModel()
+        self._rows = []
+        self._active = active
+        self._exhausted = False
+        self._wanted = None
+        self.endResetModel()
+
+    def cachedPage(self, page):
+        entry = self._cache.get((self.network.name, self.dataSetId, page))
+        if entry is None or time.monotonic() - entry[0] >= self.ttl:
+            return None
+        return entry[1]
+
+    def requestPage(self, page):
+        if page in self._jobs:
+            return
+        data = {}
+        data['pageSize'] = self.pageSize
+        data['currentPage'] = page
+        data['dataSetId'] = self.dataSetId
+        job = self.network.jobs.submit(self.network.caseListDataProcess, data)
+        job.finished.connect(partial(self.onPageLoaded, page))
+        job.failed.connect(partial(self.onPageFailed, page))
+        self._jobs[page] = job
+
+    def onPageLoaded(self, page, out):
+        if out is None:
+            # refused by the server, not an empty page
+            self.onPageFailed(page, 'the server refused page %d of the case list' % page)
+            return
+        del self._jobs[page]
+        items = out['items']
+        self._cache[(self.network.name, self.dataSetId, page)] = (time.monotonic(), items)
+        if self._wanted == page:
+            self._wanted = None
+            self.addPage(page, items)
+
+    def onPageFailed(self, page, error):
+        del self._jobs[page]
+        if self._wanted == page:
+            self._wanted = None
+            self.loadFailed.emit(error)
+
+    def addPage(self, page, items):
+        if page != len(self._rows) // self.pageSize + 1:
+            return
+        if len(items) < self.pageSize:
+            self._exhausted = True
+        if items:
+            self.beginInsertRows(QModelIndex(), len(self._rows), len(self._rows) + len(items) - 1)
+            self._rows.extend(items)
+            self.endInsertRows()
+        if not self._exhausted and self.cachedPage(page + 1) is None:
+            # prefetch the next page
+            self.requestPage(page + 1)
+
+
 class CaseListDialog(QDialog):
     def __init__(self, network, tool, parent=None):
         QDialog.__init__(self, parent)
@@ -20,81 +184,75 @@ class CaseListDialog(QDialog):
         self.list.horizontalHeader().setVisible(True)
         self.list.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Preferred)
 
-        self.model = QStandardItemModel()
-        self.model.setHorizontalHeaderItem(0, QStandardItem('dataDetailId'))
-        self.model.setHorizontalHeaderItem(1, QStandardItem('recordNo'))
-        self.model.setHorizontalHeaderItem(2, QStandardItem('source'))
-        self.model.setHorizontalHeaderItem(3, QStandardItem('addTime'))
+        self.model = CaseListModel(network, dataSetId, config.CASE_LIST_PAGE_SIZE,
+                                   config.CASE_LIST_CACHE_TTL, self)
+        self.model.loadFailed.connect(self.onJobFailed)
         self.list.setModel(self.model)
 
         self.buttonBox = QDialogButtonBox()
-        self.preButton = QPushButton('<')
-        self.nextButton = QPushButton('>')
+        self.refreshButton = QPushButton('Refresh')
         self.okButton = QPushButton('OK')
         self.cancelButton = QPushButton('Cancel')
         self.setupGui()
-        self.page = 1
+        self._detailJob = None
 
     def setupGui(self):
         self._layout = QVBoxLayout()
         self._layout.addWidget(self.list)
 
-        self.buttonBox.addButton(self.preButton, QDialogButtonBox.ActionRole)
-        self.buttonBox.addButton(self.nextButton, QDialogButtonBox.ActionRole)
+        self.buttonBox.addButton(self.refreshButton, QDialogButtonBox.ActionRole)
         self.buttonBox.addButton(self.okButton, QDialogButtonBox.ActionRole)
         self.buttonBox.addButton(self.cancelButton, QDialogButtonBox.ActionRole)
 
-        self.preButton.clicked.connect(self.onPreButton)
-        self.nextButton.clicked.connect(self.onNextButton)
+        self.refreshButton.clicked.connect(self.onRefreshButton)
         self.okButton.clicked.connect(self.onOkButton)
         self.cancelButton.clicked.connect(self.onCancelButton)
 
         self._layout.addWidget(self.buttonBox)
         self.setLayout(self._layout)
 
-    def loadData(self, data):
-        key = ['dataDetailId', 'recordNo', 'source', 'addTime']
-        list = []
-        for i in key:
-            item = data[i]
-            if type(item) is int:
-                item = str(item)
-            item = QStandardItem(item)
-            list.append(item)
-        self.model.appendRow(list)
-
-    def onPreButton(self):
-        if self.page > 1:
-            self.page = self.page - 1
-            self.getData(currentPage=self.page)
-
-    def onNextButton(self):
-        self.page = self.page + 1
-        self.getData(currentPage=self.page)
+    def onRefreshButton(self):
+        self.model.refresh(clearCache=True)
 
     def onOkButton(self):
-        indexlist = self.list.selectedIndexes()
-        data = self.model.data(indexlist[0])
-        print(data)
-        data = {'dataDetailId': int(data)}
-        model = self.network.caseDetailDataProcess(data)
-        self.tool.loadAnnotations(model)
+        indexlist = self.list.selectionModel().selectedRows()
+        if len(indexlist) == 0 or self._detailJob is not None:
+            return
+        data = {'dataDetailId': self.model.caseId(indexlist[0].row())}
+        LOG.debug("Opening case %s", data['dataDetailId'])
+        self._detailJob = self.tool.openCase(data)
+        self._detailJob.resultReady.connect(self.onCaseDetailLoaded)
+        self._detailJob.finished.connect(self.onCaseDetailLoaded)
+        self._detailJob.failed.connect(self.onJobFailed)
+        self._detailJob.progress.connect(self.onJobProgress)
+        self._detailJob.done.connect(self.onCaseDetailDone)
+        self.okButton.setEnabled(False)
+
+    def onCaseDetailLoaded(self, out):
+        # the first images are shown while the case is still loading
+        if out is None:
+            return
         self.hide()
 
+    def onCaseDetailDone(self):
+        self._detailJob = None
+        self.okButton.setEnabled(True)
+        self.setWindowTitle('')
+
     def onCancelButton(self):
+        if self._detailJob is not None:
+            self._detailJob.cancel()
         self.hide()
 
-    def getData(self, currentPage=1, pageSize=20):
-        data = {}
-        data['pageSize'] = pageSize
-        data['currentPage'] = currentPage
-        data['dataSetId'] = dataSetId
-        out = self.network.sendRequest('caseList', data)
-        out = self.network.processData(out)
-        self.model.clear()
-        if out is None:
-            return
+    def onJobFailed(self, error):
+        LOG.error("Request failed (%s)", error)
+        QMessageBox.question(self, 'message', 'Request failed: %s' % str(error), QMessageBox.Ok)
+
+    def onJobProgress(self, done, total):
+        if total > 0:
+            self.setWindowTitle('Loading... %d%%' % (100 * done // total))
         else:
-            items = out['items']
-            for i in items:
-                self.loadData(i)
+            self.setWindowTitle('Loading... %d KB' % (done // 1024))
+
+    def getData(self):
+        self.model.refresh()
@@ -58,7 +58,7 @@ class GraphicsView(QGraphicsView):
         self.setScaleRelative(factor)
 
     def focusInEvent(self, QFocusEvent):
-        print('focusInEvent')
+        QGraphicsView.focusInEvent(self, QFocusEvent)
 
     def mousePressEvent(self, event):
         if event.button() & Qt.MidButton != 0:
@@ -1,7 +1,9 @@
 #coding=utf-8
 import os
-from PyQt5.QtWidgets import QMainWindow, QMessageBox, QWidget, QVBoxLayout
-from PyQt5.QtCore import QSettings, QVariant, QSize, QPoint, QObject
+import logging
+from functools import partial
+from PyQt5.QtWidgets import QMainWindow, QMessageBox, QWidget, QVBoxLayout, QDockWidget
+from PyQt5.QtCore import QSettings, QVariant, QSize, QPoint, QObject, QTime, QTimer, Qt
 from sloth import APP_NAME, ORGANIZATION_DOMAIN
 import PyQt5.uic as uic
 from sloth.gui.frameviewer import GraphicsView
@@ -9,23 +11,30 @@ from sloth.gui.annotationscene import AnnotationScene
 from sloth.gui.controlbuttons import ControlButtonWidget
 from sloth.gui.logindl import LoginDialog
 from sloth.annotations.model import *
-from sloth.network.network import Network
+from sloth.network.network import Network, isTransient
 from sloth.gui.caselist import CaseListDialog
 from sloth.gui.annotationtool import AnnotationTool
+from sloth.gui.autosave import AutosaveService
+from sloth.gui.prefetch import CasePrefetcher
 from sloth.gui.propertyeditor import PropertyEditor
 from sloth.conf import config
 from sloth.gui.inftable import CaseInformationWidget
+from sloth.gui.tracedock import NetworkTraceWidget
 from sloth.core.utils import import_callable
 from sloth.utils.bind import *
 
 GUIDIR=os.path.join(os.path.dirname(__file__))
 
+LOG = logging.getLogger(__name__)
+
 
 class MainWindow(QMainWindow):
     def __init__(self, labeltool, parent=None):
         QMainWindow.__init__(self, parent)
         self.network = Network()
         self.tool = AnnotationTool(self, self.network)
+        self._uploadJob = None
+        self._pendingUpload = None
 
         self.logindl = LoginDialog(self.network, self)
         self.caseList = CaseListDialog(self.network, self.tool)
@@ -35,6 +44,17 @@ class MainWindow(QMainWindow):
         self.onAnnotationsLoaded()
         self.loadApplicationSettings()
 
+        self.autosave = AutosaveService(self, config.AUTOSAVE_DELAY, config.AUTOSAVE_MAX_DELAY,
+                                        config.AUTOSAVE_MAX_BACKOFF, self)
+        self.autosave.setEnabled(config.AUTOSAVE)
+
+        self.prefetcher = CasePrefetcher(self.tool, self.caseList.model, config.PREFETCH_WORKERS, self)
+        self.prefetcher.setEnabled(config.PREFETCH_NEXT_CASE)
+
+        self._replayTimer = QTimer(self)
+        self._replayTimer.timeout.connect(self.replayUploads)
+        self._replayTimer.start(config.UPLOAD_JOURNAL_REPLAY_INTERVAL)
+
         self.network.caseChanged.connect(self.inftable.onCaseChanged)
 
 
@@ -77,6 +97,14 @@ class MainWindow(QMainWindow):
         self.inftable = CaseInformationWidget(self.tool)
         self.ui.dockInformation.setWidget(self.inftable)
 
+        self.traceWidget = NetworkTraceWidget(self.network.tracer)
+        self.dockNetwork = QDockWidget('Network', self)
+        self.dockNetwork.setObjectName('dockNetwork')
+        self.dockNetwork.setWidget(self.traceWidget)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.dockNetwork)
+        self.dockNetwork.hide()
+        self.ui.menu_Views.addAction(self.dockNetwork.toggleViewAction())
+
         self.statusBar = QStatusBar()
         self.posinfo = QLabel("-1, -1")
         self.posinfo.setFrameStyle(QFrame.StyledPanel)
@@ -90,6 +118,10 @@ class MainWindow(QMainWindow):
         self.image_download.setFrameStyle(QFrame.StyledPanel)
         self.statusBar.addPermanentWidget(self.image_download)
 
+        self.save_status = QLabel()
+        self.save_status.setFrameStyle(QFrame.StyledPanel)
+        self.statusBar.addPermanentWidget(self.save_status)
+
         self.zoominfo = QLabel()
         self.zoominfo.setFrameStyle(QFrame.StyledPanel)
         self.statusBar.addPermanentWidget(self.zoominfo)
@@ -110,6 +142,8 @@ class MainWindow(QMainWindow):
         self.ui.actionLogoff.triggered.connect(self.logoff)
         self.tool.annotationsLoaded.connect(self.onAnnotationsLoaded)
         self.tool.currentImageChanged.connect(self.onCurrentImageChanged)
+        self.tool.downloadStateChanged.connect(self.onDownloadStateChanged)
+        self.tool.caseFailed.connect(self.onCaseFailed)
 
     def initShortcuts(self, HOTKEYS):
         self.shortcuts = []
@@ -167,22 +201,123 @@ class MainWindow(QMainWindow):
         if not self.okToContinue():
             return
         self.clear()
+        self.caseList.model.clear()
         self.network.logOff()
         self.onModelDirtyChanged(False)
 
-    def onSave(self):
-        print(self.tool.annotations())
-        out = self.network.labelUpload(self.tool.annotations(), isSubmit=False)
+    def saveAnnotations(self):
+        # blocking save, used when the user has to decide before continuing
+        self.network.jobs.waitForDone()
+        self._pendingUpload = None
+        model = self.tool.model()
+        images = self.changedImages(model)
+        saved = [(image, image.revision()) for image in images]
+        out = self.network.labelUpload(self.tool.annotations(images), isSubmit=False,
+                                       caseId=model.caseId())
         if out:
-            self.tool.model().setDirty(False)
+            for image, revision in saved:
+                image.setSaved(revision)
+            model.setDirty(False)
         return out
 
+    def changedImages(self, model):
+        # an edit that could not be traced to its image still has to be
+        # saved, so the whole case is sent then
+        images = model.dirtyImages()
+        if len(images) == 0 and model.dirty():
+            LOG.warning("Changed images unknown, saving the whole case")
+            images = model.root().children()
+        return images
+
+    def onSave(self):
+        self.requestUpload(isSubmit=False)
+
     def onSubmit(self):
-        print(self.tool.annotations())
-        out = self.network.labelUpload(self.tool.annotations(), isSubmit=True)
-        if out:
+        self.requestUpload(isSubmit=True)
+
+    def requestUpload(self, isSubmit):
+        # only one upload runs at a time, later requests are merged and
+        # started once it is done
+        if self._uploadJob is not None:
+            self._pendingUpload = isSubmit or bool(self._pendingUpload)
+            return
+        self.startUpload(isSubmit)
+
+    def startUpload(self, isSubmit):
+        model = self.tool.model()
+        if isSubmit and not self.tool.isComplete():
+            self.statusBar.showMessage('The case is not completely loaded and cannot be submitted', 5000)
+            return
+        # a save only sends the images changed since the last successful
+        # upload, a submit always sends the whole case
+        if isSubmit:
+            images = model.root().children()
+        else:
+            images = self.changedImages(model)
+            if len(images) == 0:
+                return
+        saved = [(image, image.revision()) for image in images]
+        annotations = self.tool.annotations(images)
+        # edits made while the upload runs mark the model dirty again
+        model.setDirty(False)
+        job = self.network.jobs.submit(self.network.labelUpload, annotations,
+                                       isSubmit=isSubmit, caseId=model.caseId())
+        job.finished.connect(partial(self.onUploadFinished, isSubmit, model, saved))
+        job.failed.connect(partial(self.onUploadFailed, model))
+        job.done.connect(self.onUploadDone)
+        self._uploadJob = job
+        self.setSaveStatus('Submitting...' if isSubmit else 'Saving...')
+
+    def onUploadFinished(self, isSubmit, model, saved, out):
+        if not out:
+            self.onUploadFailed(model, 'server rejected the labels', rejected=True)
+            return
+        if model is self.tool.model():
+            self.autosave.onUploadSucceeded()
+        for image, revision in saved:
+            image.setSaved(revision)
+        self.updateSaveStatus('Submitted' if isSubmit else 'Saved')
+        if isSubmit and model is self.tool.model():
             self.tool.clearAnnotations()
 
+    def onUploadFailed(self, model, error, rejected=None):
+        LOG.error("Upload failed (%s)", error)
+        model.setDirty(True)
+        if rejected is None:
+            rejected = not isTransient(error)
+        if model is self.tool.model():
+            self.autosave.onUploadFailed(rejected)
+        self.setSaveStatus('Save failed')
+        self.statusBar.showMessage('Upload failed: %s' % str(error), 5000)
+
+    def onUploadDone(self):
+        self._uploadJob = None
+        pending, self._pendingUpload = self._pendingUpload, None
+        if pending is not None and (pending or self.tool.model().dirty()):
+            self.startUpload(isSubmit=pending)
+
+    def setSaveStatus(self, text):
+        self.save_status.setText(text)
+
+    def updateSaveStatus(self, text):
+        pending = self.network.pendingUploads()
+        if pending:
+            self.setSaveStatus('%s offline, %d upload(s) pending' % (text, pending))
+        else:
+            self.setSaveStatus('%s %s' % (text, QTime.currentTime().toString('hh:mm:ss')))
+
+    def replayUploads(self):
+        # journaled uploads are sent in the background once the server
+        # is reachable again
+        if self._uploadJob is not None or not self.network.isLogin():
+            return
+        if self.network.pendingUploads() == 0:
+            return
+        job = self.network.jobs.submit(self.network.replayJournal)
+        job.done.connect(self.onUploadDone)
+        job.done.connect(partial(self.updateSaveStatus, 'Saved'))
+        self._uploadJob = job
+
     def onOpen(self):
         if not self.network.isLogin():
             QMessageBox.question(self, 'message', 'Please login first.', QMessageBox.Ok)
@@ -200,6 +335,18 @@ class MainWindow(QMainWindow):
         self.treeview.scrollTo(new_image.index())
         self.inftable.onImageChanged(new_image)
 
+    def onCaseFailed(self, error):
+        self.statusBar.showMessage('Loading the case failed: %s' % str(error), 5000)
+
+    def onDownloadStateChanged(self):
+        loaded, failed, total = self.tool.downloadState()
+        if total == 0:
+            self.image_download.setText('[Image Download]')
+        elif failed:
+            self.image_download.setText('[Images %d/%d, %d failed, retrying]' % (loaded, total, failed))
+        else:
+            self.image_download.setText('[Images %d/%d]' % (loaded, total))
+
     def okToContinue(self):
         if self.tool.model().dirty():
             reply = QMessageBox.question(self,
@@ -209,7 +356,7 @@ class MainWindow(QMainWindow):
             if reply == QMessageBox.Cancel:
                 return False
             elif reply == QMessageBox.Yes:
-                return self.onSave()
+                return self.saveAnnotations()
         return True
 
     def onModelDirtyChanged(self, dirty):
@@ -242,6 +389,11 @@ class MainWindow(QMainWindow):
 
     def closeEvent(self, event):
         if self.okToContinue():
+            self.tool.downloader.cancelAll()
+            self.prefetcher.cancel()
+            self.network.jobs.waitForDone()
+            if self.network.journal is not None:
+                self.network.journal.close()
             self.saveApplicationSettings()
         else:
             event.ignore()
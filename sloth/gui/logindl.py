@@ -2,10 +2,13 @@ from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 import hashlib
-from urllib.request import urlopen
+import logging
+from urllib.parse import quote
 from PIL import Image
 import numpy as np
 
+LOG = logging.getLogger(__name__)
+
 gray_color_table = [qRgb(i, i, i) for i in range(256)]
 
 
@@ -52,8 +55,7 @@ class LoginDialog(QDialog):
                                          'Please input Validate Code',
                                          QMessageBox.Ok)
             return reply
-        print(self.account.text())
-        print(self.passwd.text())
+        LOG.debug("Logging in as %s", self.account.text())
         data = {}
         data['username'] = str(self.account.text())
         data['password'] = self.getMd5(self.passwd.text().encode())
@@ -102,12 +104,11 @@ class ValidatePic(QLabel):
         self.setPixmap(pic)
 
     def getValidatePic(self, username):
-        url = 'http://115.159.237.230:8086/mrtApi/picVerifyCode?username=%s' % (username)
-        print(url)
-        pic = urlopen(url)
-        print(pic)
-        pic = Image.open(pic)
-        return np.asarray(pic)
+        url = '%spicVerifyCode?username=%s' % (self.dialog.network.url, quote(username))
+        LOG.debug("Fetching validate code from %s", url)
+        with self.dialog.network.openUrl(url) as pic:
+            pic = Image.open(pic)
+            return np.asarray(pic)
 
 
 def toQImage(im, copy=False):
@@ -0,0 +1,125 @@
+import logging
+from PyQt5.QtCore import *
+from sloth.network.download import DownloadExecutor
+from sloth.network.network import decodePic
+
+LOG = logging.getLogger(__name__)
+
+
+class PrefetchImageJob:
+    """
+    Downloads a picture of the next case into the image caches.
+    """
+
+    def __init__(self, picId, md5, network, cache, arrayCache=None):
+        self.picId = picId
+        self.md5 = md5
+        self.network = network
+        self.cache = cache
+        self.arrayCache = arrayCache
+
+    def run(self):
+        # called on a download worker thread
+        if self.cache.contains(self.picId, self.md5):
+            return
+        data, hex = self.network.fetchPic(self.picId)
+        if hex != self.md5:
+            raise RuntimeError('picture %s failed md5 verification' % self.picId)
+        self.cache.put(self.picId, hex, data)
+        if self.arrayCache is not None:
+            self.arrayCache.put(self.picId, hex, decodePic(data))
+
+    def finished(self, result):
+        pass
+
+    def failed(self, error):
+        # the picture is downloaded again when the case is opened
+        LOG.warning("Prefetching picture %s failed (%s)", self.picId, error)
+
+
+class CasePrefetcher(QObject):
+    """
+    Fetches the next case of the case list while the current one is being
+    annotated.
+
+    Once all images of the current case are downloaded, the details of the
+    case following it in the case list are fetched and kept by the network,
+    and its images are downloaded into the image cache by ``workers``
+    threads of their own.  Opening that case then needs no request at all.
+    Cases opened before are skipped.
+    """
+
+    def __init__(self, tool, caseList, workers=1, parent=None):
+        QObject.__init__(self, parent)
+        self._tool = tool
+        self._network = tool.network
+        self._caseList = caseList
+        self._enabled = True
+        self._opened = set()
+        self._caseId = None
+        self._job = None
+        self._downloader = DownloadExecutor(workers, self)
+        self._tool.caseOpening.connect(self.onCaseOpening)
+        self._tool.caseDownloaded.connect(self.prefetch)
+
+    def isEnabled(self):
+        return self._enabled
+
+    def setEnabled(self, enabled):
+        self._enabled = enabled
+        if not enabled:
+            self.cancel()
+
+    def cancel(self):
+        if self._job is not None:
+            self._job.cancel()
+            self._job = None
+        self._downloader.cancelAll()
+        self._caseId = None
+
+    def waitForDone(self, msecs=-1):
+        return self._downloader.waitForDone(msecs)
+
+    def onCaseOpening(self, caseId):
+        self._opened.add(caseId)
+        if caseId != self._caseId:
+            # the prefetched case was skipped, its downloads are useless now
+            self.cancel()
+
+    def nextCase(self):
+        current = self._tool.model().caseId()
+        model = self._caseList
+        rows = [model.caseId(row) for row in range(model.rowCount())]
+        if current not in rows:
+            return None
+        for caseId in rows[rows.index(current) + 1:]:
+            if caseId not in self._opened:
+                return caseId
+        return None
+
+    def prefetch(self):
+        if not self._enabled:
+            return
+        caseId = self.nextCase()
+        if caseId is None or caseId == self._caseId:
+            return
+        self.cancel()
+        self._caseId = caseId
+        self._job = self._network.jobs.submit(self._network.prefetchCaseDetail,
+                                              {'dataDetailId': caseId})
+        self._job.finished.connect(self.onCaseFetched)
+        self._job.failed.connect(self.onCaseFailed)
+
+    def onCaseFetched(self, images):
+        self._job = None
+        if images is None or self._tool.cache is None:
+            return
+        for picId, md5 in images:
+            if md5:
+                self._downloader.submit(PrefetchImageJob(picId, md5, self._network,
+                                                         self._tool.cache, self._tool.arrayCache))
+
+    def onCaseFailed(self, error):
+        self._job = None
+        self._caseId = None
+        LOG.warning("Prefetching case failed (%s)", error)
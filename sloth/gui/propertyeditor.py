@@ -296,7 +296,7 @@ class DefaultAttributeHandler(QGroupBox, AbstractAttributeHandler):
 
     def onButtonClicked(self, val):
         attr = self._attribute
-        LOG.debug("Button %s: %s clicked" % (attr, val))
+        LOG.debug("Button %s: %s clicked", attr, val)
         button = self._buttons[val]
 
         # Update model item
@@ -326,7 +326,7 @@ class LabelEditor(QScrollArea):
         # Find all classes
         self._label_classes = set([item['class'] for item in items if 'class' in item])
         n_classes = len(self._label_classes)
-        LOG.debug("Creating editor for %d item classes: %s" % (n_classes, ", ".join(list(self._label_classes))))
+        LOG.debug("Creating editor for %d item classes: %s", n_classes, ", ".join(self._label_classes))
 
         # Widget layout
         self._layout = QVBoxLayout()
@@ -488,7 +488,7 @@ class PropertyEditor(QWidget):
         self.endInsertionMode(False)
         for lc, button in self._class_buttons.items():
             button.setChecked(lc == label_class)
-        LOG.debug("Starting insertion mode for %s" % label_class)
+        LOG.debug("Starting insertion mode for %s", label_class)
         self._label_editor = LabelEditor([self._class_items[label_class]], self, True)
         self._layout.insertWidget(1, self._label_editor, 0)
         self.insertionModeStarted.emit(label_class)
@@ -524,7 +524,7 @@ class PropertyEditor(QWidget):
             return
 
         self.endInsertionMode()
-        LOG.debug("Starting edit mode for items: %s" % model_items)
+        LOG.debug("Starting edit mode for items: %s", model_items)
         self._label_editor = LabelEditor(model_items, self)
         self.markEditButtons(self._label_editor.labelClasses())
         self._layout.insertWidget(1, self._label_editor, 0)
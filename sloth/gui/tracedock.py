@@ -0,0 +1,94 @@
+import logging
+from PyQt5.QtWidgets import *
+from PyQt5.QtCore import *
+
+LOG = logging.getLogger(__name__)
+
+
+class NetworkTraceWidget(QWidget):
+    """
+    Shows the request statistics of a :class:`sloth.network.trace.Tracer`
+    per endpoint, refreshed every second while visible.
+    """
+
+    columns = [('Endpoint', None),
+               ('Requests', 'requests'),
+               ('Errors', 'errors'),
+               ('Retries', 'retries'),
+               ('p50 ms', ('total', 'p50')),
+               ('p95 ms', ('total', 'p95')),
+               ('p99 ms', ('total', 'p99')),
+               ('TTFB p50 ms', ('ttfb', 'p50')),
+               ('TTFB p95 ms', ('ttfb', 'p95')),
+               ('Connect p95 ms', ('connect', 'p95')),
+               ('DNS p95 ms', ('dns', 'p95')),
+               ('Sent KB', 'sent'),
+               ('Received KB', 'received')]
+
+    def __init__(self, tracer, parent=None):
+        QWidget.__init__(self, parent)
+        self.tracer = tracer
+        self.table = QTableWidget(0, len(self.columns))
+        self.table.setHorizontalHeaderLabels([name for name, _ in self.columns])
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.verticalHeader().setVisible(False)
+        self.dumpButton = QPushButton('Dump JSON...')
+        self.resetButton = QPushButton('Reset')
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self.refresh)
+        self.setupGui()
+
+    def setupGui(self):
+        buttons = QHBoxLayout()
+        buttons.addStretch(1)
+        buttons.addWidget(self.resetButton)
+        buttons.addWidget(self.dumpButton)
+        self.dumpButton.clicked.connect(self.onDump)
+        self.resetButton.clicked.connect(self.onReset)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.table)
+        layout.addLayout(buttons)
+        self.setLayout(layout)
+
+    def showEvent(self, event):
+        self.refresh()
+        self._timer.start(1000)
+        QWidget.showEvent(self, event)
+
+    def hideEvent(self, event):
+        self._timer.stop()
+        QWidget.hideEvent(self, event)
+
+    def refresh(self):
+        summary = self.tracer.summary()
+        self.table.setRowCount(len(summary))
+        for row, endpoint in enumerate(sorted(summary)):
+            stats = summary[endpoint]
+            for column, (_, key) in enumerate(self.columns):
+                self.table.setItem(row, column, QTableWidgetItem(self.format(endpoint, stats, key)))
+
+    def format(self, endpoint, stats, key):
+        if key is None:
+            return endpoint
+        if isinstance(key, tuple):
+            value = stats[key[0]].get(key[1])
+            return '' if value is None else '%.1f' % (1000 * value)
+        if key in ('sent', 'received'):
+            return '%.1f' % (stats[key] / 1024.0)
+        return str(stats[key])
+
+    def onDump(self):
+        path, _ = QFileDialog.getSaveFileName(self, 'Dump network trace', 'network-trace.json',
+                                              'JSON files (*.json)')
+        if not path:
+            return
+        try:
+            self.tracer.dump(path)
+        except OSError as e:
+            LOG.error("Writing network trace failed (%s)", e)
+            QMessageBox.warning(self, 'message', 'Writing network trace failed: %s' % str(e))
+
+    def onReset(self):
+        self.tracer.reset()
+        self.refresh()
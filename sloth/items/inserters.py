@@ -2,6 +2,7 @@ from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from sloth.conf import config
+from sloth.annotations import codec
 
 
 class ItemInserter(QObject):
@@ -145,10 +146,8 @@ class PolylineItemInserter(ItemInserter):
 
     def _updateAnnotation(self):
         polygon = self._item.polygon()
-        self._ann.update({self._prefix + 'xn':
-                              ";".join([str(p.x()) for p in polygon]),
-                          self._prefix + 'yn':
-                              ";".join([str(p.y()) for p in polygon])})
+        codec.setPolygon(self._ann, [p.x() for p in polygon],
+                         [p.y() for p in polygon], self._prefix)
         self._ann.update(self._default_properties)
 
     def onScaleChanged(self, scale):
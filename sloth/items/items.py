@@ -2,6 +2,10 @@ from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 from sloth.conf import config
+from sloth.annotations import codec
+import logging
+
+LOG = logging.getLogger(__name__)
 
 
 class BaseItem(QAbstractGraphicsShapeItem):
@@ -40,8 +44,8 @@ class BaseItem(QAbstractGraphicsShapeItem):
         self._valid = True
 
         if len(self.cycleValuesOnKeypress) > 0:
-           print("cycleValueOnKeypress is deprecated and will be removed in the future. " +
-                "Set BaseItem.hotkeys instead with cycleValue()")
+           LOG.warning("cycleValueOnKeypress is deprecated and will be removed in the future. "
+                       "Set BaseItem.hotkeys instead with cycleValue()")
         self.changeColor()
 
     def changeColor(self):
@@ -175,8 +179,7 @@ class PolygonItem(BaseItem):
         self.setOpacity(0.6)
 
         self._updatePolygon(self._dataToPolygon(self._model_item))
-        print("Constructed polygon %s for model item %s" %
-                  (self._polygon, model_item))
+        LOG.debug("Constructed polygon %s for model item %s", self._polygon, model_item)
         self.pos = None
         color = config.COLORMAP[model_item['class']]
         brush = QBrush(QColor(color[0], color[1], color[2], 255), Qt.SolidPattern)
@@ -198,16 +201,11 @@ class PolygonItem(BaseItem):
             return QPolygonF()
 
         try:
-            polygon = QPolygonF()
-            xn = [float(x) for x in model_item["xn"].split(";")]
-            yn = [float(y) for y in model_item["yn"].split(";")]
-            for x, y in zip(xn, yn):
-                polygon.append(QPointF(x, y))
-            return polygon
+            xn, yn = codec.polygonPoints(model_item, self.prefix())
+            return QPolygonF([QPointF(x, y) for x, y in zip(xn.tolist(), yn.tolist())])
 
         except KeyError as e:
-            print("PolygonItem: Could not find expected key in item: "
-                      + str(e) + ". Check your config!")
+            LOG.warning("PolygonItem: Could not find expected key in item: %s. Check your config!", e)
             self.setValid(False)
             return QPolygonF()
 
@@ -218,8 +216,7 @@ class PolygonItem(BaseItem):
             note = self._model_item[name]
             return note
         except KeyError as e:
-            print("PolygonItem: Could not find expected key in item: "
-                      + str(e) + ". Check your config!")
+            LOG.warning("PolygonItem: Could not find expected key in item: %s. Check your config!", e)
             return ''
 
     def dataToIndex(self):
@@ -229,8 +226,7 @@ class PolygonItem(BaseItem):
             index = self._model_item['combo']
             return index
         except KeyError as e:
-            print("PolygonItem: Could not find expected key in item: "
-                      + str(e) + ". Check your config!")
+            LOG.warning("PolygonItem: Could not find expected key in item: %s. Check your config!", e)
             return 0
 
     def _updatePolygon(self, polygon):
@@ -247,14 +243,9 @@ class PolygonItem(BaseItem):
         return QAbstractGraphicsShapeItem.itemChange(self, change, value)
 
     def updateModel(self):
-        xn = [str(p.x()) for p in self._polygon]
-        yn = [str(p.y()) for p in self._polygon]
-        strx = ';'.join(xn)
-        stry = ';'.join(yn)
-        self._model_item.update({
-            self.prefix() + 'xn': strx,
-            self.prefix() + 'yn': stry
-        })
+        xn = [p.x() for p in self._polygon]
+        yn = [p.y() for p in self._polygon]
+        codec.setPolygon(self._model_item, xn, yn, self.prefix())
 
     def updateTo(self, key, data):
         self._model_item.update({
@@ -0,0 +1,171 @@
+"""
+Persistent on-disk cache for downloaded images.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class ImageCache:
+    """
+    Content-addressed cache of encoded image files.
+
+    Every entry is stored as ``<picId>-<md5>`` in ``directory`` and is only
+    returned if its content still matches the md5 the server announced for
+    the picture.  The total size is capped at ``maxsize`` bytes; the least
+    recently used entries are evicted first.  Files are written to a
+    temporary name and atomically renamed, so a crash never leaves a
+    truncated entry behind.
+    """
+
+    suffix = ''
+
+    def __init__(self, directory, maxsize):
+        self.directory = directory
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._byPicId = {}
+        self._size = 0
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith('.tmp'):
+                os.remove(entry.path)
+                continue
+            if not entry.name.endswith(self.suffix):
+                continue
+            st = entry.stat()
+            files.append((st.st_mtime, entry.name, st.st_size))
+        for _, name, size in sorted(files):
+            self._add(name, size)
+
+    def _add(self, name, size):
+        self._entries[name] = size
+        self._byPicId[self._picId(name)] = name
+        self._size += size
+
+    def _remove(self, name):
+        self._size -= self._entries.pop(name)
+        picId = self._picId(name)
+        if self._byPicId.get(picId) == name:
+            del self._byPicId[picId]
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+    def _name(self, picId, md5):
+        return '%s-%s%s' % (picId, md5, self.suffix)
+
+    def _picId(self, name):
+        return name.rsplit('-', 1)[0]
+
+    def size(self):
+        return self._size
+
+    def contains(self, picId, md5):
+        with self._lock:
+            return self._name(picId, md5) in self._entries
+
+    def get(self, picId, md5):
+        name = self._name(picId, md5)
+        with self._lock:
+            if name not in self._entries:
+                return None
+            self._entries.move_to_end(name)
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            data = None
+        if data is None or hashlib.md5(data).hexdigest() != md5:
+            with self._lock:
+                if name in self._entries:
+                    self._remove(name)
+            return None
+        return data
+
+    def put(self, picId, md5, data):
+        """
+        Stores ``data``, which the caller has already verified against
+        ``md5``.  ``data`` may be any bytes-like object.
+        """
+        if not md5 or len(data) > self.maxsize:
+            return False
+        return self._store(picId, md5, len(data), lambda f: f.write(data))
+
+    def _store(self, picId, md5, size, write):
+        name = self._name(picId, md5)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp, os.path.join(self.directory, name))
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return False
+        with self._lock:
+            if name in self._entries:
+                self._size -= self._entries.pop(name)
+            old = self._byPicId.get(str(picId))
+            if old is not None and old != name:
+                self._remove(old)
+            self._add(name, size)
+            while self._size > self.maxsize:
+                self._remove(next(iter(self._entries)))
+        return True
+
+
+class ArrayCache(ImageCache):
+    """
+    Second cache tier holding decoded pixel arrays as ``.npy`` files.
+
+    The ``.npy`` header records shape and dtype, and entries are opened
+    with ``np.load(mmap_mode='r')``: a cached picture costs neither a PIL
+    decode nor a resident copy of the full-resolution array.  Entries are
+    keyed like :class:`ImageCache`, i.e. by picId and the md5 of the
+    encoded file they were decoded from.
+    """
+
+    suffix = '.npy'
+
+    def _picId(self, name):
+        return ImageCache._picId(self, name[:-len(self.suffix)])
+
+    def get(self, picId, md5):
+        name = self._name(picId, md5)
+        with self._lock:
+            if name not in self._entries:
+                return None
+            self._entries.move_to_end(name)
+        path = os.path.join(self.directory, name)
+        try:
+            pic = np.load(path, mmap_mode='r', allow_pickle=False)
+            os.utime(path)
+            return pic
+        except (OSError, ValueError):
+            with self._lock:
+                if name in self._entries:
+                    self._remove(name)
+            return None
+
+    def put(self, picId, md5, pic):
+        pic = np.ascontiguousarray(pic)
+        # header size is not known up front, a few hundred bytes at most
+        size = pic.nbytes + 128
+        if not md5 or size > self.maxsize:
+            return False
+        return self._store(picId, md5, size,
+                           lambda f: np.save(f, pic, allow_pickle=False))
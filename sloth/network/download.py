@@ -0,0 +1,128 @@
+"""
+Fixed-size worker pool for image downloads.
+"""
+import heapq
+import itertools
+import threading
+from PyQt5.QtCore import *
+
+
+class DownloadScheduler:
+    """
+    Thread-safe queue of pending jobs ordered by priority (lowest first).
+    Jobs with equal priority are handed out in submission order.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heap = []
+        self._counter = itertools.count()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._heap)
+
+    def put(self, item, priority=0):
+        with self._lock:
+            heapq.heappush(self._heap, (priority, next(self._counter), item))
+
+    def take(self):
+        """
+        Returns the pending item with the lowest priority, or None if there
+        is none.
+        """
+        with self._lock:
+            if not self._heap:
+                return None
+            return heapq.heappop(self._heap)[2]
+
+    def reprioritise(self, priority):
+        """
+        Recomputes the priority of every pending item with ``priority(item)``.
+        Items already taken by a worker are not affected.
+        """
+        with self._lock:
+            self._heap = [(priority(item), seq, item) for _, seq, item in self._heap]
+            heapq.heapify(self._heap)
+
+    def clear(self):
+        with self._lock:
+            self._heap = []
+
+
+class _DownloadRunnable(QRunnable):
+    # runs the most urgent pending job at the time a pool thread is free,
+    # one runnable is started per submitted job
+    def __init__(self, executor):
+        QRunnable.__init__(self)
+        self.executor = executor
+
+    def run(self):
+        self.executor._runNext()
+
+
+class DownloadExecutor(QObject):
+    """
+    Runs download jobs on a private thread pool of ``workers`` threads.
+
+    A job is any object with a ``run()`` method, which is called on a
+    pool thread, and ``finished(result)`` / ``failed(error)`` methods,
+    which are called on the thread the executor lives in (the GUI thread)
+    through a queued signal.  The result is handed over by reference, not
+    copied; the job must not touch it on the pool thread after returning
+    it.  Pending jobs are started in priority order, see
+    :meth:`reprioritise`.  :meth:`cancelAll` drops all pending jobs;
+    results of jobs that are already running are discarded.
+    """
+
+    _jobFinished = pyqtSignal(object, object, int)
+    _jobFailed = pyqtSignal(object, object, int)
+
+    def __init__(self, workers=4, parent=None):
+        QObject.__init__(self, parent)
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(workers)
+        self._scheduler = DownloadScheduler()
+        self._generation = 0
+        self._jobFinished.connect(self._onJobFinished, Qt.QueuedConnection)
+        self._jobFailed.connect(self._onJobFailed, Qt.QueuedConnection)
+
+    def submit(self, job, priority=0):
+        self._scheduler.put((self._generation, job), priority)
+        self._pool.start(_DownloadRunnable(self))
+
+    def reprioritise(self, priority):
+        self._scheduler.reprioritise(lambda entry: priority(entry[1]))
+
+    def cancelAll(self):
+        self._generation += 1
+        self._scheduler.clear()
+
+    def pending(self):
+        return len(self._scheduler)
+
+    def waitForDone(self, msecs=-1):
+        return self._pool.waitForDone(msecs)
+
+    def _runNext(self):
+        # called on a pool thread
+        entry = self._scheduler.take()
+        if entry is None:
+            return
+        generation, job = entry
+        if generation != self._generation:
+            return
+        try:
+            result = job.run()
+        except Exception as e:
+            self._jobFailed.emit(job, e, generation)
+        else:
+            self._jobFinished.emit(job, result, generation)
+
+    def _onJobFinished(self, job, result, generation):
+        if generation == self._generation:
+            job.finished(result)
+
+    def _onJobFailed(self, job, error, generation):
+        if generation == self._generation:
+            job.failed(error)
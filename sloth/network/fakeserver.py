@@ -0,0 +1,368 @@
+"""
+Local stand-in for the annotation server API.
+
+Serves synthetic cases under ``/mrtApi/`` with the same endpoints and
+request format as the real server, so loading, saving and downloading can
+be measured and tested without a network.  Latency, bandwidth and errors
+can be injected per request.  Run it with::
+
+    python -m sloth.network.fakeserver --port 8086 --cases 50 --images 40
+
+and start sloth with ``--server http://127.0.0.1:8086/mrtApi/``.
+"""
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import parse
+from PIL import Image
+import numpy as np
+from sloth.annotations import codec
+
+BASE_PATH = '/mrtApi/'
+CLASSES = ('TZ', 'SCJ', 'CIS', 'CIGN', 'PUN', 'MOS', 'AE')
+
+
+class FakeData:
+    """
+    Deterministic synthetic cases.  Every case has ``images`` pictures of
+    ``imageSize`` pixels, each with ``polygons`` polygons of ``points``
+    vertices.  Pictures are generated on first request and kept encoded.
+    Uploaded labels replace the generated ones of the same tag.
+    """
+
+    def __init__(self, cases=20, images=10, imageSize=(512, 512), polygons=2,
+                 points=32, format='JPEG', seed=0):
+        self.cases = cases
+        self.images = images
+        self.imageSize = imageSize
+        self.polygons = polygons
+        self.points = points
+        self.format = format
+        self.seed = seed
+        self.labels = {}
+        self.compactTokens = set()
+        self.uploads = 0
+        self.downloaded = set()
+        self._pics = {}
+        self._lock = threading.Lock()
+
+    def picId(self, case, index):
+        return case * 10000 + index
+
+    def tagId(self, case, index):
+        return 1000000 + self.picId(case, index)
+
+    def caseList(self, currentPage=1, pageSize=20):
+        start = (max(1, currentPage) - 1) * pageSize
+        items = []
+        for case in range(start, min(start + pageSize, self.cases)):
+            items.append({'dataDetailId': case,
+                          'recordNo': 'R%06d' % case,
+                          'source': 'fake',
+                          'addTime': '2017-01-01 00:00:00'})
+        return {'items': items, 'total': self.cases,
+                'currentPage': currentPage, 'pageSize': pageSize}
+
+    def caseDetail(self, case, encoding=codec.TEXT):
+        if not 0 <= case < self.cases:
+            return None
+        images = []
+        for index in range(self.images):
+            picId = self.picId(case, index)
+            tagId = self.tagId(case, index)
+            with self._lock:
+                tagData = self.labels.get(tagId)
+            if tagData is None:
+                tagData = self.polygonsFor(picId)
+            tagData = [codec.encodeAnnotation(ann, encoding) for ann in tagData]
+            images.append({'picId': picId,
+                           'picName': '%d.%s' % (picId, self.format.lower()),
+                           'md5': hashlib.md5(self.pic(picId)).hexdigest(),
+                           'picTypeName': 'fake',
+                           'picExplain': '',
+                           'tag': {'tagId': tagId, 'tagData': tagData}})
+        return {'recordNo': 'R%06d' % case, 'dataDetailId': case, 'images': images}
+
+    def polygonsFor(self, picId):
+        rng = random.Random(self.seed * 7919 + picId)
+        width, height = self.imageSize
+        polygons = []
+        for _ in range(self.polygons):
+            cx, cy = rng.uniform(0, width), rng.uniform(0, height)
+            radius = rng.uniform(5, min(width, height) / 4.0)
+            xn, yn = [], []
+            for k in range(self.points):
+                angle = 2 * np.pi * k / self.points
+                r = radius * rng.uniform(0.7, 1.0)
+                xn.append('%.2f' % (cx + r * np.cos(angle)))
+                yn.append('%.2f' % (cy + r * np.sin(angle)))
+            polygons.append({'class': rng.choice(CLASSES),
+                             'xn': ';'.join(xn), 'yn': ';'.join(yn)})
+        return polygons
+
+    def pic(self, picId):
+        with self._lock:
+            data = self._pics.get(picId)
+        if data is not None:
+            return data
+        width, height = self.imageSize
+        rng = np.random.RandomState((self.seed * 7919 + picId) % 2**32)
+        # smooth noise compresses like a real picture, not like random bytes
+        small = rng.randint(0, 256, (max(1, height // 16), max(1, width // 16)), dtype=np.uint8)
+        img = Image.fromarray(small).resize((width, height), Image.BILINEAR)
+        buf = io.BytesIO()
+        img.save(buf, self.format)
+        data = buf.getvalue()
+        with self._lock:
+            self._pics[picId] = data
+        return data
+
+    def upload(self, payload):
+        with self._lock:
+            self.uploads += 1
+            for label in payload.get('labels', []):
+                self.labels[label['tagId']] = label['tagData']
+        return True
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeMrtApi/1.0'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def endpoint(self):
+        path = parse.urlsplit(self.path).path
+        if not path.startswith(BASE_PATH):
+            return None
+        return path[len(BASE_PATH):]
+
+    def inject(self):
+        """
+        Sleeps for the configured latency and returns False if the request
+        is to fail; the failure has already been sent then.
+        """
+        server = self.server
+        delay = server.latency + random.uniform(0, server.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if server.errorRate <= 0 or random.random() >= server.errorRate:
+            return True
+        if random.random() < 0.5:
+            self.close_connection = True
+        else:
+            self.sendBody(b'injected error', 'text/plain', status=500)
+        return False
+
+    def sendBody(self, body, contentType, status=200, headers=None, compress=False):
+        encoding = None
+        if compress:
+            accepted = self.headers.get('Accept-Encoding') or ''
+            if 'gzip' in accepted:
+                body, encoding = gzip.compress(body), 'gzip'
+            elif 'deflate' in accepted:
+                body, encoding = zlib.compress(body), 'deflate'
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        if encoding is not None:
+            self.send_header('Content-Encoding', encoding)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.writeThrottled(body)
+
+    def writeThrottled(self, body):
+        bandwidth = self.server.bandwidth
+        if bandwidth <= 0:
+            self.wfile.write(body)
+            return
+        chunk = max(1024, int(bandwidth / 50))
+        for start in range(0, len(body), chunk):
+            self.wfile.write(body[start:start + chunk])
+            self.wfile.flush()
+            time.sleep(len(body[start:start + chunk]) / float(bandwidth))
+
+    def sendJson(self, data, status=1, message=''):
+        body = json.dumps({'status': status, 'message': message, 'data': data}).encode('utf-8')
+        self.sendBody(body, 'application/json;charset=UTF-8', compress=True)
+
+    def readArgs(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        query = parse.parse_qs(body.decode('utf-8'))
+        return json.loads(query['args'][0])
+
+    def do_POST(self):
+        endpoint = self.endpoint()
+        try:
+            args = self.readArgs()
+        except (KeyError, ValueError, OSError):
+            self.sendBody(b'bad request', 'text/plain', status=400)
+            return
+        if not self.inject():
+            return
+        data = self.server.data
+        request = args.get('data') or {}
+        if endpoint == 'login':
+            username = request.get('username', '')
+            token = hashlib.md5(username.encode()).hexdigest()
+            out = {'name': username, 'token': token}
+            if codec.COMPACT in request.get('polygonEncodings', []) and self.server.compact:
+                data.compactTokens.add(token)
+                out['polygonEncoding'] = codec.COMPACT
+            else:
+                data.compactTokens.discard(token)
+            self.sendJson(out)
+        elif endpoint == 'caseList':
+            self.sendJson(data.caseList(int(request.get('currentPage', 1)),
+                                        int(request.get('pageSize', 20))))
+        elif endpoint == 'caseDetail':
+            encoding = codec.COMPACT if args.get('token') in data.compactTokens else codec.TEXT
+            detail = data.caseDetail(int(request.get('dataDetailId', -1)), encoding)
+            if detail is None:
+                self.sendJson(None, status=0, message='No such case')
+            else:
+                self.sendJson(detail)
+        elif endpoint == 'downloaded':
+            data.downloaded.add(request.get('dataDetailId'))
+            self.sendJson({})
+        elif endpoint == 'labelUpload':
+            data.upload(request)
+            self.sendJson({})
+        else:
+            self.sendBody(b'not found', 'text/plain', status=404)
+
+    def do_GET(self):
+        endpoint = self.endpoint()
+        if not self.inject():
+            return
+        query = parse.parse_qs(parse.urlsplit(self.path).query)
+        if endpoint == 'download':
+            try:
+                picId = int(json.loads(query['args'][0])['data']['picId'])
+            except (KeyError, ValueError, TypeError):
+                self.sendBody(b'bad request', 'text/plain', status=400)
+                return
+            self.sendPic(self.server.data.pic(picId))
+        elif endpoint == 'picVerifyCode':
+            img = Image.new('RGB', (80, 30), (255, 255, 255))
+            buf = io.BytesIO()
+            img.save(buf, 'PNG')
+            self.sendBody(buf.getvalue(), 'image/png')
+        else:
+            self.sendBody(b'not found', 'text/plain', status=404)
+
+    def sendPic(self, pic):
+        etag = '"%s"' % hashlib.md5(pic).hexdigest()
+        contentType = 'image/%s' % self.server.data.format.lower()
+        headers = {'ETag': etag, 'Accept-Ranges': 'bytes'}
+        rng = self.headers.get('Range')
+        ifRange = self.headers.get('If-Range')
+        if rng and rng.startswith('bytes=') and ifRange in (None, etag):
+            start = int(rng[len('bytes='):].split('-', 1)[0] or 0)
+            if start >= len(pic):
+                headers['Content-Range'] = 'bytes */%d' % len(pic)
+                self.sendBody(b'', contentType, status=416, headers=headers)
+                return
+            headers['Content-Range'] = 'bytes %d-%d/%d' % (start, len(pic) - 1, len(pic))
+            self.sendBody(pic[start:], contentType, status=206, headers=headers)
+            return
+        self.sendBody(pic, contentType, headers=headers)
+
+
+class FakeServer:
+    """
+    Runs a fake annotation server on a background thread.
+
+    ``latency`` (plus up to ``jitter``) seconds are added to every request,
+    response bodies are sent at ``bandwidth`` bytes per second (0 for
+    unlimited) and ``errorRate`` of the requests fail with either a 500 or
+    a dropped connection.  With ``compact``, the server accepts the compact
+    polygon encoding of :mod:`sloth.annotations.codec` if a client offers it.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0,
+                 bandwidth=0, errorRate=0.0, verbose=False, compact=True, **kwargs):
+        self.data = FakeData(**kwargs)
+        self._httpd = ThreadingHTTPServer((host, port), FakeHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.data = self.data
+        self._httpd.verbose = verbose
+        self._httpd.compact = compact
+        self._thread = None
+        self.setFaults(latency, jitter, bandwidth, errorRate)
+
+    def setFaults(self, latency=0.0, jitter=0.0, bandwidth=0, errorRate=0.0):
+        self._httpd.latency = latency
+        self._httpd.jitter = jitter
+        self._httpd.bandwidth = bandwidth
+        self._httpd.errorRate = errorRate
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return 'http://%s:%d%s' % (host, port, BASE_PATH)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def serveForever(self):
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the annotation server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8086)
+    parser.add_argument('--cases', type=int, default=20)
+    parser.add_argument('--images', type=int, default=10, help='images per case')
+    parser.add_argument('--image-size', default='512x512', help='WIDTHxHEIGHT')
+    parser.add_argument('--format', default='JPEG', choices=('JPEG', 'PNG'))
+    parser.add_argument('--polygons', type=int, default=2, help='polygons per image')
+    parser.add_argument('--points', type=int, default=32, help='points per polygon')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per request')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random extra seconds')
+    parser.add_argument('--bandwidth', type=int, default=0, help='bytes per second, 0 for unlimited')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of failing requests')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--text-only', action='store_true',
+                        help='do not accept the compact polygon encoding')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    width, height = (int(v) for v in args.image_size.lower().split('x'))
+
+    server = FakeServer(args.host, args.port, args.latency, args.jitter, args.bandwidth,
+                        args.error_rate, args.verbose, not args.text_only, cases=args.cases, images=args.images,
+                        imageSize=(width, height), polygons=args.polygons,
+                        points=args.points, format=args.format, seed=args.seed)
+    print('Serving on %s' % server.url)
+    try:
+        server.serveForever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
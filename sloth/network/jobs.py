@@ -0,0 +1,155 @@
+"""
+Background jobs for blocking server calls, so the GUI thread never waits
+on the network.
+"""
+import threading
+from functools import partial
+from PyQt5.QtCore import *
+from sloth.core.exceptions import JobCancelled
+
+_current = threading.local()
+
+
+def reportProgress(done, total=-1):
+    """
+    Reports progress of the job running on the calling thread, if any.
+    Raises :class:`JobCancelled` if that job has been cancelled, so long
+    running calls can be interrupted at their progress points.
+    """
+    job = getattr(_current, 'job', None)
+    if job is None:
+        return
+    if job.isCancelled():
+        raise JobCancelled()
+    job._progress.emit(done, total)
+
+
+def reportResult(result):
+    """
+    Hands a partial result of the job running on the calling thread to its
+    ``resultReady`` signal, e.g. the first records of a long response.
+    Raises :class:`JobCancelled` if that job has been cancelled.
+    """
+    job = getattr(_current, 'job', None)
+    if job is None:
+        return
+    if job.isCancelled():
+        raise JobCancelled()
+    job._resultReady.emit(result)
+
+
+class Job(QObject):
+    """
+    A function call executed on a :class:`JobRunner` thread.
+
+    ``finished(result)``, ``failed(error)``, ``progress(done, total)`` and
+    ``resultReady(result)`` are emitted on the thread the job was created in.  After :meth:`cancel`
+    none of them is emitted any more; ``done`` is emitted in every case.
+    """
+
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(object)
+    progress = pyqtSignal(int, int)
+    resultReady = pyqtSignal(object)
+    done = pyqtSignal()
+
+    _finished = pyqtSignal(object)
+    _failed = pyqtSignal(object)
+    _progress = pyqtSignal(int, int)
+    _resultReady = pyqtSignal(object)
+    _done = pyqtSignal()
+
+    def __init__(self, fn, *args, **kwargs):
+        QObject.__init__(self)
+        self._fn = fn
+        self._args = args
+        self._kwargs = kwargs
+        self._cancelled = False
+        self._isDone = False
+        self._finished.connect(self._onFinished, Qt.QueuedConnection)
+        self._failed.connect(self._onFailed, Qt.QueuedConnection)
+        self._progress.connect(self._onProgress, Qt.QueuedConnection)
+        self._resultReady.connect(self._onResultReady, Qt.QueuedConnection)
+        self._done.connect(self._onDone, Qt.QueuedConnection)
+
+    def cancel(self):
+        self._cancelled = True
+
+    def isCancelled(self):
+        return self._cancelled
+
+    def isDone(self):
+        return self._isDone
+
+    def run(self):
+        # called on a job thread
+        try:
+            if self._cancelled:
+                return
+            _current.job = self
+            try:
+                result = self._fn(*self._args, **self._kwargs)
+            except JobCancelled:
+                pass
+            except Exception as e:
+                self._failed.emit(e)
+            else:
+                self._finished.emit(result)
+        finally:
+            _current.job = None
+            self._done.emit()
+
+    def _onFinished(self, result):
+        if not self._cancelled:
+            self.finished.emit(result)
+
+    def _onFailed(self, error):
+        if not self._cancelled:
+            self.failed.emit(error)
+
+    def _onProgress(self, done, total):
+        if not self._cancelled:
+            self.progress.emit(done, total)
+
+    def _onResultReady(self, result):
+        if not self._cancelled:
+            self.resultReady.emit(result)
+
+    def _onDone(self):
+        self._isDone = True
+        self.done.emit()
+
+
+class _JobRunnable(QRunnable):
+    def __init__(self, job):
+        QRunnable.__init__(self)
+        self.job = job
+
+    def run(self):
+        self.job.run()
+
+
+class JobRunner(QObject):
+    """
+    Runs :class:`Job` objects on a private thread pool.
+    """
+
+    def __init__(self, maxThreads=2, parent=None):
+        QObject.__init__(self, parent)
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(maxThreads)
+        self._jobs = set()
+
+    def submit(self, fn, *args, **kwargs):
+        job = Job(fn, *args, **kwargs)
+        self._jobs.add(job)
+        job.done.connect(partial(self._jobs.discard, job))
+        self._pool.start(_JobRunnable(job))
+        return job
+
+    def cancelAll(self):
+        for job in self._jobs:
+            job.cancel()
+
+    def waitForDone(self, msecs=-1):
+        return self._pool.waitForDone(msecs)
@@ -0,0 +1,147 @@
+"""
+Write-ahead journal of label uploads, so edits survive a failing server
+and are replayed once it can be reached again.
+"""
+import json
+import os
+import threading
+
+
+class UploadJournal:
+    """
+    Append-only log of label uploads stored as JSON lines in ``path``.
+
+    Every upload is appended before it is sent and committed once the
+    server accepted (or definitely rejected) it.  Records are flushed
+    immediately but only fsync'ed every ``syncEvery`` records or on
+    :meth:`sync`, trading the last few edits for not blocking every save
+    on the disk.
+
+    Labels are identified by ``(dataDetailId, tagId)``; a label in a newer
+    entry supersedes the same label in all older entries, so replaying the
+    journal never overwrites newer labels with older ones and replaying an
+    entry twice is harmless.
+    """
+
+    def __init__(self, path, syncEvery=8):
+        self.path = path
+        self.syncEvery = syncEvery
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._latest = {}
+        self._seq = 0
+        self._unsynced = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._load()
+        self._file = open(path, 'a', encoding='utf-8')
+        if not self._entries:
+            self._compact()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        # byte offset of the end of the last record read
+        end = 0
+        newline = True
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    # torn write of the last record
+                    break
+                end += len(line)
+                newline = line.endswith(b'\n')
+                self._seq = max(self._seq, record['seq'])
+                if record['op'] == 'upload':
+                    self._addEntry(record)
+                elif record['op'] == 'commit':
+                    self._entries.pop(record['ref'], None)
+        # cut off a torn record, otherwise the next one is appended to it
+        # and lost as well
+        with open(self.path, 'r+b') as f:
+            f.truncate(end)
+            if not newline:
+                f.seek(end)
+                f.write(b'\n')
+            os.fsync(f.fileno())
+
+    def _addEntry(self, record):
+        self._entries[record['seq']] = record
+        caseId = record['payload']['dataDetailId']
+        for label in record['payload']['labels']:
+            self._latest[(caseId, label['tagId'])] = record['seq']
+
+    def _write(self, record):
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        self._unsynced += 1
+        if self._unsynced >= self.syncEvery:
+            self.sync()
+
+    def sync(self):
+        with self._lock:
+            if self._unsynced:
+                os.fsync(self._file.fileno())
+                self._unsynced = 0
+
+    def append(self, payload, user=''):
+        with self._lock:
+            self._seq += 1
+            record = {'seq': self._seq, 'op': 'upload', 'user': user, 'payload': payload}
+            self._write(record)
+            self._addEntry(record)
+            return self._seq
+
+    def commit(self, seq):
+        with self._lock:
+            if self._entries.pop(seq, None) is None:
+                return
+            self._seq += 1
+            self._write({'seq': self._seq, 'op': 'commit', 'ref': seq})
+            if not self._entries:
+                self._compact()
+
+    def _compact(self):
+        self._file.truncate(0)
+        self._file.seek(0)
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._latest = {}
+
+    def pendingCount(self, user=None):
+        with self._lock:
+            return len(self.pending(user))
+
+    def pending(self, user=None):
+        """
+        Returns the sequence numbers of the uncommitted entries of ``user``
+        in the order they were appended.
+        """
+        with self._lock:
+            return [seq for seq, record in sorted(self._entries.items())
+                    if user is None or record['user'] == user]
+
+    def effectivePayload(self, seq):
+        """
+        Returns the payload of entry ``seq`` without the labels superseded
+        by newer entries, or None if nothing of it is left to send.
+        """
+        with self._lock:
+            record = self._entries.get(seq)
+            if record is None:
+                return None
+            payload = dict(record['payload'])
+            caseId = payload['dataDetailId']
+            payload['labels'] = [label for label in payload['labels']
+                                 if self._latest.get((caseId, label['tagId'])) == seq]
+            if not payload['labels'] and 'isSubmit' not in payload:
+                return None
+            return payload
+
+    def close(self):
+        with self._lock:
+            self.sync()
+            self._file.close()
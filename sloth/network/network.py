@@ -1,118 +1,359 @@
-from urllib import request
 from urllib.parse import quote
 from urllib import parse
+import codecs
+import gzip
+import io
 import json
+import logging
+import random
+import threading
+import time
+import zlib
 from PIL import Image
 import numpy as np
 import hashlib
 from PyQt5.QtCore import *
+from sloth.conf import config
+from sloth.annotations import codec
+from sloth.core.exceptions import NetworkError
+from sloth.network.pool import ConnectionPool
+from sloth.network.jobs import JobRunner, reportProgress, reportResult
+from sloth.network.stream import CaseDetailParser, imageRecord
+from sloth.network.journal import UploadJournal
+from sloth.network.trace import Tracer
+from http.client import HTTPException, IncompleteRead
 
-URL = 'http://115.159.237.230:8086/mrtApi/'
+LOG = logging.getLogger(__name__)
 
 class Network(QObject):
     caseChanged = pyqtSignal(object)
-    def __init__(self):
+    def __init__(self, url=None):
         QObject.__init__(self)
+        self.url = url or config.SERVER_URL
         self.name = ''
         self.token = ''
         self._loginFlag = False
         self.caseId = ''
+        self.polygonEncoding = codec.TEXT
+        self.pool = ConnectionPool(maxsize=config.NETWORK_POOL_SIZE,
+                                   maxPerHost=config.NETWORK_POOL_PER_HOST,
+                                   idleTimeout=config.NETWORK_POOL_IDLE_TIMEOUT,
+                                   timeout=config.NETWORK_TIMEOUT)
+        self._buffers = threading.local()
+        self.jobs = JobRunner(config.NETWORK_JOB_THREADS, self)
+        self.tracer = Tracer(config.NETWORK_TRACE_KEEP, config.NETWORK_TRACE)
+        self.journal = None
+        if config.UPLOAD_JOURNAL:
+            self.journal = UploadJournal(config.UPLOAD_JOURNAL, config.UPLOAD_JOURNAL_SYNC_EVERY)
+        self._uploadLock = threading.Lock()
+        self._compressUploads = config.NETWORK_COMPRESS_UPLOADS
+        self._statsLock = threading.Lock()
+        self._prefetchLock = threading.Lock()
+        self._prefetched = {}
+        self._transfer = dict.fromkeys(['requests', 'sent', 'sentUncompressed',
+                                        'received', 'receivedUncompressed'], 0)
 
     def isLogin(self):
         return self._loginFlag
 
-    def sendRequest(self, port, data):
+    def poolStats(self):
+        return self.pool.stats()
+
+    def openUrl(self, url, data=None, headers=None, timeout=None, trace=None):
+        method = 'GET' if data is None else 'POST'
+        headers = dict(headers or {})
+        if data is not None:
+            headers.setdefault('Content-Type', 'application/x-www-form-urlencoded')
+        out = self.pool.urlopen(method, url, body=data, headers=headers, timeout=timeout)
+        if trace is not None:
+            trace.response(out)
+        if out.status >= 400:
+            out.close()
+            raise NetworkError('HTTP %d %s from %s' % (out.status, out.reason, url), out.status)
+        return out
+
+    def sendRequest(self, port, data, compress=False):
+        out = b''.join(self.streamRequest(port, data, compress))
+        out = out.decode('utf-8')
+        LOG.debug("Response from %s: %s", port, out)
+        return out
+
+    def streamRequest(self, port, data, compress=False):
+        """
+        Sends a request and yields the decoded response body in chunks
+        as it arrives.
+        """
         requestData = {}
         requestData['token'] = self.token
         requestData['data'] = data
         requestData = json.dumps(requestData)
-        print(requestData)
-        finalurl = '%s%s' % (URL, port)
-        print(finalurl)
+        finalurl = '%s%s' % (self.url, port)
+        LOG.debug("Request to %s: %s", finalurl, requestData)
         args = {'args':requestData}
         args = parse.urlencode(args).encode(encoding='utf-8')
-        print(args)
-        req = request.Request(url=finalurl, data=args)
-        out = request.urlopen(req)
-        out = out.read().decode('utf-8')
-        print(out)
-        return out
+        headers = {'Accept-Encoding': 'gzip, deflate'}
+        body = args
+        if compress and self._compressUploads and len(args) >= 1024:
+            body = gzip.compress(args)
+            headers['Content-Encoding'] = 'gzip'
+        with self.tracer.trace(port, 'POST') as trace:
+            trace.sent = len(body)
+            try:
+                response = self.openUrl(finalurl, body, headers, trace=trace)
+            except NetworkError as e:
+                if body is args or e.status not in (400, 415):
+                    raise
+                # the server does not accept compressed request bodies
+                self._compressUploads = False
+                del headers['Content-Encoding']
+                body = args
+                trace.retries += 1
+                trace.sent += len(body)
+                response = self.openUrl(finalurl, body, headers, trace=trace)
+            with response:
+                decoder = ContentDecoder(response.getheader('Content-Encoding'))
+                length = response.getheader('Content-Length')
+                total = int(length) if length is not None else -1
+                done = 0
+                size = 0
+                while True:
+                    chunk = response.read(64 * 1024)
+                    if not chunk:
+                        break
+                    done += len(chunk)
+                    trace.received = done
+                    chunk = decoder.decompress(chunk)
+                    size += len(chunk)
+                    reportProgress(done, total)
+                    if chunk:
+                        yield chunk
+                chunk = decoder.flush()
+                size += len(chunk)
+                if chunk:
+                    yield chunk
+            trace.bodyDone()
+        self._countTransfer(len(body), len(args), done, size)
+
+    def _countTransfer(self, sent, sentRaw, received, receivedRaw):
+        with self._statsLock:
+            self._transfer['requests'] += 1
+            self._transfer['sent'] += sent
+            self._transfer['sentUncompressed'] += sentRaw
+            self._transfer['received'] += received
+            self._transfer['receivedUncompressed'] += receivedRaw
+
+    def transferStats(self):
+        """
+        Byte counts of the JSON requests, on the wire and uncompressed.
+        """
+        with self._statsLock:
+            return dict(self._transfer)
 
     def processData(self, data):
         data = json.loads(data)
         if data['status'] == 1:
             if data['message'] != '':
-                print(data['message'])
+                LOG.info("Server message: %s", data['message'])
             return data['data']
         else:
-            print(data['status'])
+            LOG.warning("Server returned status %s (%s)", data['status'], data.get('message'))
             return None
 
     def loginDataProcess(self, data):
+        if config.POLYGON_ENCODING == codec.COMPACT:
+            # offer the compact polygon encoding, see sloth.annotations.codec
+            data = dict(data, polygonEncodings=[codec.COMPACT])
         out = self.sendRequest('login', data)
         out = self.processData(out)
         if out is None:
             return 0
         self.name = out['name']
         self.token = out['token']
+        self.polygonEncoding = codec.TEXT
+        if out.get('polygonEncoding') == codec.COMPACT and config.POLYGON_ENCODING == codec.COMPACT:
+            self.polygonEncoding = codec.COMPACT
+        codec.setEncoding(self.polygonEncoding)
         self._loginFlag = True
         return 1
 
-    def downloadSuccess(self):
-        data = {'dataDetailId': self.caseId}
+    def caseListDataProcess(self, data):
+        out = self.sendRequest('caseList', data)
+        return self.processData(out)
+
+    def downloadSuccess(self, caseId=None):
+        data = {'dataDetailId': self.caseId if caseId is None else caseId}
         self.sendRequest('downloaded', data)
 
-    def labelUpload(self, data, isSubmit=False):
-        data = self.modelDeTrans(data, isSubmit)
-        out = self.sendRequest('labelUpload', data)
+    def labelUpload(self, data, isSubmit=False, caseId=None):
+        """
+        Uploads labels.  With the upload journal enabled, the labels are
+        journaled first and a failure to reach the server is not an error:
+        they are sent by a later :meth:`replayJournal`.  Returns False only
+        if the server rejected them.
+        """
+        data = self.modelDeTrans(data, isSubmit, caseId)
+        if self.journal is None:
+            return self.sendLabels(data)
+        seq = self.journal.append(data, self.name)
+        results = self.replayJournal()
+        return results.get(seq, True)
+
+    def sendLabels(self, data):
+        # journaled labels may be in an encoding the server does not accept
+        for label in data['labels']:
+            label['tagData'] = [codec.encodeAnnotation(ann, self.polygonEncoding)
+                                for ann in label['tagData']]
+        out = self.sendRequest('labelUpload', data, compress=True)
         out = json.loads(out)
         if out['status'] == 1:
             return True
         else:
             return False
 
+    def replayJournal(self):
+        """
+        Sends the journaled uploads of the current user in order, stopping
+        at the first one the server cannot be reached for.  Uploads the
+        server refuses for good, with a client error or a malformed answer,
+        are dropped from the journal.  Returns a dict mapping the journal
+        entries handled to whether they were accepted.
+        """
+        results = {}
+        if self.journal is None:
+            return results
+        with self._uploadLock:
+            for seq in self.journal.pending(self.name):
+                payload = self.journal.effectivePayload(seq)
+                if payload is not None:
+                    try:
+                        results[seq] = self.sendLabels(payload)
+                    except (NetworkError, HTTPException, OSError) as e:
+                        if isTransient(e):
+                            LOG.error("Upload failed, kept for replay (%s)", e)
+                            break
+                        LOG.error("Server refused journaled upload %d (%s)", seq, e)
+                        results[seq] = False
+                    except (ValueError, KeyError, TypeError) as e:
+                        LOG.error("Invalid answer to journaled upload %d (%s)", seq, e)
+                        results[seq] = False
+                    else:
+                        if not results[seq]:
+                            LOG.error("Server rejected journaled upload %d", seq)
+                self.journal.commit(seq)
+        return results
+
+    def pendingUploads(self):
+        if self.journal is None:
+            return 0
+        return self.journal.pendingCount(self.name)
+
     def logOff(self):
+        with self._prefetchLock:
+            self._prefetched = {}
         self.name = ''
         self.token = ''
         self._loginFlag = False
 
-    def caseDetailDataProcess(self, data):
-        out = self.sendRequest('caseDetail', data)
-        out = self.processData(out)
-        if out is None:
-            return
+    def iterCaseDetail(self, data, parser=None):
+        """
+        Yields the image records of a case while the caseDetail response
+        is still arriving.  ``parser`` holds the status and the case info
+        once the iteration is done.
+        """
+        if parser is None:
+            parser = CaseDetailParser()
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        for chunk in self.streamRequest('caseDetail', data):
+            for image in parser.feed(decoder.decode(chunk)):
+                yield imageRecord(image)
+        parser.feed(decoder.decode(b'', final=True))
+        for image in parser.close():
+            yield imageRecord(image)
+        if parser.ok:
+            if parser.message != '':
+                LOG.info("Server message: %s", parser.message)
         else:
-            out = self.modelTrans(out)
-            self.caseId = data['dataDetailId']
-            return out
-
-    def modelTrans(self, data):
-        caseInfo = {}
-        for key, item in data.items():
-            if key != 'images':
-                caseInfo[key] = item
+            LOG.warning("Server returned status %s (%s)", parser.status, parser.message)
+
+    def setCase(self, caseId, caseInfo):
+        self.caseId = caseId
         self.caseChanged.emit(caseInfo)
-        outs = []
-        print(data)
-        for image in data['images']:
-            out = {}
-            out['class'] = 'image'
-            for key, item in image.items():
-                if key != 'tag':
-                    out[key] = item
-            out['tagId'] = image['tag']['tagId']
-            list = []
-            if image['tag']['tagData'] is not None:
-                for tag in image['tag']['tagData']:
-                    list.append(tag)
-            out['annotations'] = list
-            outs.append(out)
-        print(outs)
-        return outs
 
-    def modelDeTrans(self, data, isSubmit):
+    def caseDetailDataProcess(self, data):
+        parser = CaseDetailParser()
+        out = list(self.iterCaseDetail(data, parser))
+        if not parser.ok:
+            return None
+        self.setCase(data['dataDetailId'], parser.caseInfo)
+        return out
+
+    def streamCaseDetail(self, data, batchSize=16):
+        """
+        Job function loading a case: the image records are handed out with
+        :func:`reportResult` as they arrive, the first one on its own and
+        the others in batches of ``batchSize``.  A case prefetched with
+        :meth:`prefetchCaseDetail` is handed out at once.  Returns the
+        number of records, or None if the server refused the case.
+        """
+        # the case is shown from the first records on
+        self.caseId = data['dataDetailId']
+        prefetched = self.takePrefetched(data['dataDetailId'])
+        if prefetched is not None:
+            records, caseInfo = prefetched
+            if records:
+                reportResult(records)
+            self.setCase(data['dataDetailId'], caseInfo)
+            return len(records)
+        parser = CaseDetailParser()
+        count = 0
+        batch = []
+        for record in self.iterCaseDetail(data, parser):
+            batch.append(record)
+            if count == 0 or len(batch) >= batchSize:
+                count += len(batch)
+                reportResult(batch)
+                batch = []
+        if batch:
+            count += len(batch)
+            reportResult(batch)
+        if not parser.ok:
+            return None
+        self.setCase(data['dataDetailId'], parser.caseInfo)
+        return count
+
+    def prefetchCaseDetail(self, data):
+        """
+        Job function fetching a case ahead of time.  It is kept for
+        PREFETCH_TTL seconds and used by the next :meth:`streamCaseDetail`
+        of the case.  Returns the ``(picId, md5)`` of its images, or None
+        if the server refused the case.
+        """
+        parser = CaseDetailParser()
+        records = list(self.iterCaseDetail(data, parser))
+        if not parser.ok:
+            return None
+        with self._prefetchLock:
+            self._prefetched[data['dataDetailId']] = (time.monotonic(), records, parser.caseInfo)
+        return [(record['picId'], record.get('md5')) for record in records]
+
+    def takePrefetched(self, caseId):
+        """
+        Removes and returns ``(records, caseInfo)`` of a prefetched case,
+        or None if it was not prefetched or has expired.
+        """
+        with self._prefetchLock:
+            entry = self._prefetched.pop(caseId, None)
+            now = time.monotonic()
+            for key in [key for key, value in self._prefetched.items()
+                        if now - value[0] >= config.PREFETCH_TTL]:
+                del self._prefetched[key]
+        if entry is None or now - entry[0] >= config.PREFETCH_TTL:
+            return None
+        return entry[1], entry[2]
+
+    def modelDeTrans(self, data, isSubmit, caseId=None):
         outs = {}
-        outs['dataDetailId'] = self.caseId
+        outs['dataDetailId'] = self.caseId if caseId is None else caseId
         if isSubmit:
             outs['isSubmit'] = 'true'
         list = []
@@ -128,27 +369,198 @@ class Network(QObject):
         outs['labels'] = list
         return outs
 
-    def downloadPic(self, picId):
+    def fetchPic(self, picId):
+        """
+        Downloads a picture in a single pass, hashing it while reading.
+        Returns a memoryview of the body together with its md5.  The view
+        points into a buffer reused by the calling thread and is only valid
+        until its next call of fetchPic.
+
+        Failed attempts are retried with exponential backoff; the next
+        attempt asks the server only for the missing part of the body.
+        """
         req = {}
         req['token'] = self.token
         req['data'] = {'picId': picId}
         req = json.dumps(req)
-        finalurl = '%s%s?args=%s' % (URL, 'download', req)
+        finalurl = '%s%s?args=%s' % (self.url, 'download', req)
         finalurl = quote(finalurl, safe='=/:?&')
-        print(finalurl)
-        out = request.urlopen(finalurl)
-        print(type(out))
-        im = Image.open(out)
-        md5hex = self.getmd5(out)
-        print('image download success')
-        return (np.asarray(im), md5hex)
-
-    def getmd5(self, pic):
+        LOG.debug("Downloading picture %s", picId)
+        with self.tracer.trace('download', 'GET') as trace:
+            return self._fetchPic(picId, finalurl, trace)
+
+    def _fetchPic(self, picId, finalurl, trace):
+        buf = self._buffer(0)
         myhash = hashlib.md5()
+        pos = 0
+        validator = None
+        attempt = 0
         while True:
-            b = pic.read(8096)
-            if not b:
-                break
-            myhash.update(b)
-        hex = myhash.hexdigest()
-        return hex
+            headers = {}
+            if pos:
+                headers['Range'] = 'bytes=%d-' % pos
+                if validator is not None:
+                    headers['If-Range'] = validator
+            try:
+                with self.openUrl(finalurl, headers=headers, timeout=config.DOWNLOAD_TIMEOUT,
+                                  trace=trace) as out:
+                    if pos and out.status != 206:
+                        # range not honoured, the full body follows
+                        pos = 0
+                        myhash = hashlib.md5()
+                    validator = out.getheader('ETag') or out.getheader('Last-Modified')
+                    length = out.getheader('Content-Length')
+                    expected = pos + int(length) if length is not None else None
+                    buf = self._buffer(expected or 0, keep=pos)
+                    while True:
+                        if pos == len(buf):
+                            buf = self._buffer(2 * len(buf), keep=pos)
+                        view = memoryview(buf)[pos:]
+                        n = out.readinto(view)
+                        if not n:
+                            break
+                        myhash.update(view[:n])
+                        pos += n
+                        trace.received += n
+                    if expected is not None and pos < expected:
+                        raise IncompleteRead(b'', expected - pos)
+                trace.bodyDone()
+                return (memoryview(buf)[:pos], myhash.hexdigest())
+            except (NetworkError, HTTPException, OSError) as e:
+                if getattr(e, 'status', None) == 416:
+                    pos = 0
+                    myhash = hashlib.md5()
+                elif not isTransient(e):
+                    raise
+                attempt += 1
+                if attempt > config.DOWNLOAD_RETRIES:
+                    raise
+                trace.retries += 1
+                delay = min(config.DOWNLOAD_BACKOFF_MAX, config.DOWNLOAD_BACKOFF * 2 ** (attempt - 1))
+                delay = random.uniform(0, delay)
+                LOG.warning("Downloading picture %s failed (%s), retry in %.1fs", picId, e, delay)
+                time.sleep(delay)
+
+    def _buffer(self, size, keep=0):
+        # per-thread download buffer, grown by reallocation because views of
+        # the old buffer may still be alive
+        buf = getattr(self._buffers, 'buf', None)
+        if buf is None or len(buf) < size:
+            new = bytearray(max(size, 64 * 1024))
+            if keep:
+                new[:keep] = buf[:keep]
+            buf = self._buffers.buf = new
+        return buf
+
+
+def isTransient(error):
+    """
+    Whether a failed request may succeed when sent again: transport errors,
+    server errors, timeouts and rate limiting, but not other client errors.
+    """
+    status = getattr(error, 'status', None)
+    return status is None or status >= 500 or status in (408, 429)
+
+
+class ContentDecoder:
+    """
+    Incremental decoder for gzip or deflate encoded response bodies.
+    """
+
+    def __init__(self, encoding):
+        encoding = (encoding or 'identity').strip().lower()
+        self._encoding = encoding
+        self._started = False
+        if encoding in ('gzip', 'x-gzip'):
+            self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            self._obj = zlib.decompressobj()
+        elif encoding == 'identity':
+            self._obj = None
+        else:
+            raise NetworkError('Unsupported content encoding %s' % encoding)
+
+    def decompress(self, data):
+        if self._obj is None:
+            return data
+        try:
+            out = self._obj.decompress(data)
+        except zlib.error:
+            if self._started or self._encoding != 'deflate':
+                raise
+            # some servers send raw deflate data without zlib header
+            self._obj = zlib.decompressobj(-zlib.MAX_WBITS)
+            out = self._obj.decompress(data)
+        self._started = True
+        return out
+
+    def flush(self):
+        if self._obj is None:
+            return b''
+        return self._obj.flush()
+
+
+class BufferReader(io.RawIOBase):
+    """
+    Seekable file object over a bytes-like object, so PIL can decode
+    directly from a download buffer without copying it first.
+    """
+
+    def __init__(self, data):
+        io.RawIOBase.__init__(self)
+        self._view = memoryview(data).cast('B')
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self._view) - self._pos))
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+def decodePic(data):
+    """
+    Decodes a picture into a read-only array, which can be handed between
+    threads and viewed by a QImage without copying.
+    """
+    with Image.open(BufferReader(data)) as im:
+        pic = np.asarray(im)
+    pic.flags.writeable = False
+    return pic
+
+
+def decodePreview(data, size):
+    """
+    Decodes a JPEG picture at a reduced resolution of at least ``size``
+    pixels on its longer side, which is several times faster than a full
+    decode.  Returns the read-only array together with the full size
+    (width, height), or None if the picture cannot be decoded smaller.
+    """
+    with Image.open(BufferReader(data)) as im:
+        if im.format != 'JPEG':
+            return None
+        full = im.size
+        scale = size / float(max(full))
+        im.draft(im.mode, (int(full[0] * scale), int(full[1] * scale)))
+        if im.size == full:
+            return None
+        pic = np.asarray(im)
+    pic.flags.writeable = False
+    return (pic, full)
@@ -0,0 +1,217 @@
+"""
+HTTP/1.1 keep-alive connection pool used by :class:`sloth.network.network.Network`.
+"""
+import socket
+import threading
+import time
+from http import client
+from urllib.parse import urlsplit
+
+
+def _createConnection(conn, address, timeout, source_address=None):
+    """
+    ``socket.create_connection`` with the name lookup timed separately,
+    the time is left in ``conn.dnsTime``.
+    """
+    host, port = address
+    start = time.monotonic()
+    infos = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    conn.dnsTime = time.monotonic() - start
+    error = None
+    for family, type, proto, _, addr in infos:
+        sock = None
+        try:
+            sock = socket.socket(family, type, proto)
+            if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(addr)
+            return sock
+        except OSError as e:
+            error = e
+            if sock is not None:
+                sock.close()
+    if error is not None:
+        raise error
+    raise OSError('getaddrinfo returns an empty list')
+
+
+class PooledResponse:
+    """
+    Thin wrapper around an ``http.client.HTTPResponse``.  The underlying
+    connection goes back to the pool once the body has been read completely,
+    and is discarded if the response is closed before that.
+
+    ``timings`` holds the seconds spent resolving the host (``dns``) and
+    connecting (``connect``, including the TLS handshake) for a new
+    connection, and from sending the request to receiving the status line
+    (``ttfb``); ``reused`` tells whether an idle connection was used.
+    """
+
+    def __init__(self, pool, key, conn, response, timings=None):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self.timings = timings or {}
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def read(self, amt=None):
+        data = self._response.read(amt)
+        if amt is None or not data:
+            self._release()
+        return data
+
+    def readinto(self, b):
+        n = self._response.readinto(b)
+        if n == 0:
+            self._release()
+        return n
+
+    def close(self):
+        self._release()
+
+    def _release(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        reusable = self._response.isclosed() and not self._response.will_close
+        self._response.close()
+        self._pool._release(self._key, conn, reusable)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ConnectionPool:
+    """
+    Keeps idle HTTP connections per (scheme, host, port) for reuse.
+
+    ``maxsize`` bounds the number of idle connections kept over all hosts,
+    ``maxPerHost`` bounds the number of connections in use to a single host;
+    callers block until one is released.  Idle connections older than
+    ``idleTimeout`` seconds are closed instead of reused.
+    """
+
+    def __init__(self, maxsize=8, maxPerHost=4, idleTimeout=30.0, timeout=None):
+        self.maxsize = maxsize
+        self.maxPerHost = maxPerHost
+        self.idleTimeout = idleTimeout
+        self.timeout = timeout
+        self._lock = threading.Condition()
+        self._idle = {}
+        self._active = {}
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'idle': sum(len(conns) for conns in self._idle.values()),
+                    'active': sum(self._active.values())}
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn, _ in conns:
+                conn.close()
+
+    def urlopen(self, method, url, body=None, headers=None, timeout=None):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        if parts.query:
+            path = '%s?%s' % (path, parts.query)
+        headers = dict(headers or {})
+        headers.setdefault('Connection', 'keep-alive')
+
+        timeout = self.timeout if timeout is None else timeout
+        conn, reused = self._acquire(key)
+        timings = {'reused': reused}
+        try:
+            try:
+                response = self._send(conn, method, path, body, headers, timeout, timings)
+            except (client.RemoteDisconnected, client.BadStatusLine, ConnectionError):
+                if not reused:
+                    raise
+                # the server dropped the idle connection, retry on a fresh one
+                conn.close()
+                conn = self._connect(key)
+                timings = {'reused': False}
+                response = self._send(conn, method, path, body, headers, timeout, timings)
+        except BaseException:
+            self._release(key, conn, False)
+            raise
+        return PooledResponse(self, key, conn, response, timings)
+
+    def _setTimeout(self, conn, timeout):
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+
+    def _send(self, conn, method, path, body, headers, timeout, timings):
+        self._setTimeout(conn, timeout)
+        if conn.sock is None:
+            conn.dnsTime = 0.0
+            start = time.monotonic()
+            conn.connect()
+            timings['dns'] = conn.dnsTime
+            timings['connect'] = time.monotonic() - start - conn.dnsTime
+        start = time.monotonic()
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        timings['ttfb'] = time.monotonic() - start
+        return response
+
+    def _connect(self, key):
+        scheme, host, port = key
+        if scheme == 'https':
+            conn = client.HTTPSConnection(host, port, timeout=self.timeout)
+        else:
+            conn = client.HTTPConnection(host, port, timeout=self.timeout)
+        conn._create_connection = lambda address, timeout, source_address: \
+            _createConnection(conn, address, timeout, source_address)
+        return conn
+
+    def _acquire(self, key):
+        with self._lock:
+            while True:
+                idle = self._idle.get(key, [])
+                now = time.monotonic()
+                while idle:
+                    conn, since = idle.pop()
+                    if now - since > self.idleTimeout:
+                        conn.close()
+                        continue
+                    self._active[key] = self._active.get(key, 0) + 1
+                    self.hits += 1
+                    return conn, True
+                if self._active.get(key, 0) < self.maxPerHost:
+                    self._active[key] = self._active.get(key, 0) + 1
+                    self.misses += 1
+                    break
+                self._lock.wait()
+        return self._connect(key), False
+
+    def _release(self, key, conn, reusable):
+        with self._lock:
+            self._active[key] -= 1
+            if reusable:
+                total = sum(len(conns) for conns in self._idle.values())
+                if total < self.maxsize:
+                    self._idle.setdefault(key, []).append((conn, time.monotonic()))
+                    conn = None
+            self._lock.notify_all()
+        if conn is not None:
+            conn.close()
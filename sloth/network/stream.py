@@ -0,0 +1,156 @@
+"""
+Incremental parsing of caseDetail responses, so the images of a case can
+be shown while the rest of the response is still arriving.
+"""
+import json
+import re
+
+
+def imageRecord(image):
+    """
+    Turns an image of a caseDetail response into the record an
+    ``ImageFileModelItem`` is created from.  The annotation list of the
+    response is used as is, not copied.
+    """
+    tag = image.pop('tag')
+    image['class'] = 'image'
+    image['tagId'] = tag['tagId']
+    image['annotations'] = tag['tagData'] if tag['tagData'] is not None else []
+    return image
+
+
+class CaseDetailParser:
+    """
+    Parses a caseDetail response fed in arbitrary pieces.
+
+    :meth:`feed` returns the images of ``data.images`` completed by the new
+    text, each decoded on its own as soon as its closing brace arrived.
+    The text is scanned only once: the position inside the current image,
+    its brace depth and whether a string is open are kept between calls.
+    The remaining document is kept without the images and decoded in
+    :meth:`close`, which sets ``status``, ``message`` and ``caseInfo`` (the
+    case without its images).
+    """
+
+    _images = re.compile(r'"images"\s*:\s*\[')
+    _gap = re.compile(r'[\s,]*')
+    # a complete string, or a brace, a bracket or the quote of a string
+    # continued in the next piece
+    _token = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[{}\[\]"]')
+    _stringEnd = re.compile(r'["\\]')
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._head = None
+        self._state = 'head'
+        # scanner state of the image being received
+        self._parts = []
+        self._depth = 0
+        self._inString = False
+        self._escape = False
+        self.status = None
+        self.message = ''
+        self.caseInfo = None
+
+    @property
+    def ok(self):
+        return self.status == 1
+
+    def feed(self, text):
+        images = []
+        if self._state == 'head':
+            self._buffer += text
+            match = self._images.search(self._buffer)
+            if match is None:
+                return images
+            self._head = self._buffer[:match.start()]
+            text = self._buffer[match.end():]
+            self._buffer = ''
+            self._state = 'images'
+        if self._state == 'images':
+            text = self._scan(text, images)
+        if self._state == 'tail':
+            self._buffer += text
+        return images
+
+    def _scan(self, text, images):
+        # appends the images completed in text, returns the text following
+        # the image list
+        pos = 0
+        start = 0
+        end = len(text)
+        while pos < end:
+            if self._depth == 0:
+                pos = self._gap.match(text, pos).end()
+                if pos == end:
+                    break
+                if text[pos] == ']':
+                    self._state = 'tail'
+                    return text[pos + 1:]
+                if text[pos] != '{':
+                    raise ValueError('unexpected %r in the image list of a caseDetail response' % text[pos])
+                start = pos
+                self._depth = 1
+                pos += 1
+            elif self._inString:
+                if self._escape:
+                    self._escape = False
+                    pos += 1
+                    continue
+                match = self._stringEnd.search(text, pos)
+                if match is None:
+                    pos = end
+                elif match.group() == '"':
+                    self._inString = False
+                    pos = match.end()
+                else:
+                    self._escape = True
+                    pos = match.end()
+            else:
+                match = self._token.search(text, pos)
+                if match is None:
+                    pos = end
+                    break
+                pos = match.end()
+                token = match.group()
+                if token == '"':
+                    self._inString = True
+                elif token[0] == '"':
+                    pass
+                elif token in '{[':
+                    self._depth += 1
+                else:
+                    self._depth -= 1
+                    if self._depth == 0:
+                        self._parts.append(text[start:pos])
+                        image = ''.join(self._parts)
+                        self._parts = []
+                        images.append(self._decoder.decode(image))
+        if self._depth:
+            self._parts.append(text[start:])
+        return ''
+
+    def close(self):
+        """
+        Decodes the rest of the document and returns the images not yet
+        returned by :meth:`feed`.  Raises ValueError if the document is
+        truncated or malformed.
+        """
+        images = []
+        if self._state == 'head':
+            document = json.loads(self._buffer)
+            data = document.get('data')
+            if isinstance(data, dict):
+                images = data.get('images') or []
+        elif self._state == 'images':
+            raise ValueError('caseDetail response ends inside the image list')
+        else:
+            document = json.loads(self._head + '"images": []' + self._buffer)
+        self._buffer = ''
+        self.status = document.get('status')
+        self.message = document.get('message', '')
+        data = document.get('data')
+        if isinstance(data, dict):
+            self.caseInfo = dict((key, item) for key, item in data.items() if key != 'images')
+        return images
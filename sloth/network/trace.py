@@ -0,0 +1,223 @@
+"""
+Tracing of the requests to the annotation server.
+
+Every request is recorded with its timings, byte counts, status and
+retries; the timings are aggregated per endpoint in latency histograms.
+"""
+import bisect
+import json
+import math
+import threading
+import time
+from collections import deque
+
+TIMINGS = ('dns', 'connect', 'ttfb', 'transfer', 'total')
+
+
+class LatencyHistogram:
+    """
+    Histogram of durations in seconds with logarithmic buckets, ``perDecade``
+    buckets per factor of ten between ``low`` and ``high``.  Percentiles
+    are accurate to the bucket width (about 12% with the defaults), while
+    memory does not grow with the number of samples.
+    """
+
+    def __init__(self, low=1e-5, high=1e3, perDecade=20):
+        decades = math.log10(high / low)
+        self._bounds = [low * 10 ** (i / perDecade) for i in range(int(decades * perDecade) + 1)]
+        self._counts = [0] * (len(self._bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self._counts[bisect.bisect_left(self._bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, p):
+        """
+        Returns the upper bound of the bucket holding the ``p`` percentile,
+        clamped to the largest value seen.
+        """
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(self.count * p / 100.0)))
+        seen = 0
+        for i, n in enumerate(self._counts):
+            seen += n
+            if seen >= rank:
+                if i == len(self._bounds):
+                    return self.max
+                return min(self._bounds[i], self.max)
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return {'count': 0}
+        return {'count': self.count,
+                'mean': self.sum / self.count,
+                'min': self.min,
+                'max': self.max,
+                'p50': self.percentile(50),
+                'p95': self.percentile(95),
+                'p99': self.percentile(99)}
+
+
+class RequestTrace:
+    """
+    Timings of one request, filled in by the network layer.  Use it as a
+    context manager around the request: the total time is measured and
+    the trace is recorded on exit, including failed requests.
+    """
+
+    def __init__(self, tracer, endpoint, method):
+        self._tracer = tracer
+        self.endpoint = endpoint
+        self.method = method
+        self.status = None
+        self.error = None
+        self.retries = 0
+        self.sent = 0
+        self.received = 0
+        self.reused = None
+        self.dns = None
+        self.connect = None
+        self.ttfb = None
+        self.transfer = None
+        self.total = None
+        self._start = None
+        self._bodyStart = None
+
+    def response(self, response):
+        """
+        Takes status and connection timings from a ``PooledResponse``;
+        the transfer time runs from here to :meth:`bodyDone`.
+        """
+        self.status = response.status
+        timings = getattr(response, 'timings', {})
+        self.reused = timings.get('reused')
+        self.dns = timings.get('dns')
+        self.connect = timings.get('connect')
+        self.ttfb = timings.get('ttfb')
+        self._bodyStart = time.monotonic()
+
+    def bodyDone(self):
+        if self._bodyStart is not None:
+            self.transfer = time.monotonic() - self._bodyStart
+
+    def __enter__(self):
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.total = time.monotonic() - self._start
+        if type is GeneratorExit:
+            # the consumer of a streamed response stopped reading
+            self.error = 'cancelled'
+        elif value is not None:
+            self.error = '%s: %s' % (type.__name__, value)
+        self._tracer.record(self)
+        return False
+
+    def asDict(self):
+        return {'time': self._start,
+                'endpoint': self.endpoint,
+                'method': self.method,
+                'status': self.status,
+                'error': self.error,
+                'retries': self.retries,
+                'sent': self.sent,
+                'received': self.received,
+                'reused': self.reused,
+                'dns': self.dns,
+                'connect': self.connect,
+                'ttfb': self.ttfb,
+                'transfer': self.transfer,
+                'total': self.total}
+
+
+class _EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.sent = 0
+        self.received = 0
+        self.status = {}
+        self.timings = dict((name, LatencyHistogram()) for name in TIMINGS)
+
+    def add(self, trace):
+        self.requests += 1
+        if trace.error is not None or (trace.status is not None and trace.status >= 400):
+            self.errors += 1
+        self.retries += trace.retries
+        self.sent += trace.sent
+        self.received += trace.received
+        key = str(trace.status) if trace.status is not None else 'none'
+        self.status[key] = self.status.get(key, 0) + 1
+        for name in TIMINGS:
+            value = getattr(trace, name)
+            if value is not None:
+                self.timings[name].add(value)
+
+    def summary(self):
+        out = {'requests': self.requests,
+               'errors': self.errors,
+               'retries': self.retries,
+               'sent': self.sent,
+               'received': self.received,
+               'status': dict(self.status)}
+        for name in TIMINGS:
+            out[name] = self.timings[name].summary()
+        return out
+
+
+class Tracer:
+    """
+    Collects :class:`RequestTrace` records per endpoint and keeps the last
+    ``keep`` of them.  Thread-safe; used from the job and download threads.
+    """
+
+    def __init__(self, keep=200, enabled=True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._recent = deque(maxlen=keep)
+
+    def trace(self, endpoint, method='POST'):
+        return RequestTrace(self, endpoint, method)
+
+    def record(self, trace):
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self._stats.get(trace.endpoint)
+            if stats is None:
+                stats = self._stats[trace.endpoint] = _EndpointStats()
+            stats.add(trace)
+            self._recent.append(trace)
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+            self._recent.clear()
+
+    def summary(self):
+        with self._lock:
+            return dict((endpoint, stats.summary()) for endpoint, stats in self._stats.items())
+
+    def recent(self):
+        with self._lock:
+            return [trace.asDict() for trace in self._recent]
+
+    def dumps(self):
+        return json.dumps({'endpoints': self.summary(), 'recent': self.recent()},
+                          indent=4, sort_keys=True)
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            f.write(self.dumps() + '\n')
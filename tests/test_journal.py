@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sloth.network.journal import UploadJournal
+
+
+def payload(tagId):
+    return {'dataDetailId': 1, 'labels': [{'tagId': tagId, 'tagData': []}]}
+
+
+class UploadJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'uploads.journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def tear(self):
+        # a crash in the middle of writing a record
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write('{"seq": 99, "op": "upl')
+
+    def testReload(self):
+        journal = UploadJournal(self.path)
+        first = journal.append(payload(1))
+        second = journal.append(payload(2))
+        journal.commit(first)
+        journal.close()
+        journal = UploadJournal(self.path)
+        self.assertEqual(journal.pending(), [second])
+        journal.close()
+
+    def testTornTailThenAppend(self):
+        journal = UploadJournal(self.path)
+        first = journal.append(payload(1))
+        journal.close()
+        self.tear()
+        journal = UploadJournal(self.path)
+        self.assertEqual(journal.pending(), [first])
+        second = journal.append(payload(2))
+        journal.close()
+        journal = UploadJournal(self.path)
+        self.assertEqual(journal.pending(), [first, second])
+        self.assertIsNotNone(journal.effectivePayload(second))
+        journal.close()
+
+    def testRecordWithoutNewline(self):
+        journal = UploadJournal(self.path)
+        first = journal.append(payload(1))
+        journal.close()
+        with open(self.path, 'rb+') as f:
+            f.seek(-1, os.SEEK_END)
+            f.truncate()
+        journal = UploadJournal(self.path)
+        second = journal.append(payload(2))
+        journal.close()
+        journal = UploadJournal(self.path)
+        self.assertEqual(journal.pending(), [first, second])
+        journal.close()
+
+
+if __name__ == '__main__':
+    unittest.main()